@@ -1,13 +1,16 @@
+import argparse
 import asyncio
-import sys
 import threading
 import time
 import traceback
 
-import pygame
 
-from src.game import Game
-from src.true_client import Player
+def positive_float(text: str) -> float:
+    """Parse a command line number that must be more than zero."""
+    value = float(text)
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f"must be more than 0, not {text}")
+    return value
 
 
 async def main():
@@ -16,34 +19,72 @@ async def main():
 
 
 if __name__ == "__main__":
-    loop = asyncio.new_event_loop()
-    ws_thread = threading.Thread(target=loop.run_forever)
-    game = Game()
+    started = time.perf_counter()
+
+    parser = argparse.ArgumentParser(description="Play the game, connected to a server.")
+    parser.add_argument("websocket_url", nargs="?", default="ws://localhost:8001", help="server to connect to")
+    parser.add_argument(
+        "--profile-startup", action="store_true", help="print the time spent in each phase of startup, then exit"
+    )
+    parser.add_argument(
+        "--move-rate",
+        type=positive_float,
+        default=15,
+        help="most times a second to send our position (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-datagrams", action="store_true", help="send movement over the websocket, rather than by UDP"
+    )
+    args = parser.parse_args()
+
+    # Imported once arguments are parsed, so --help doesn't wait on pygame
+    import pygame
 
-    if len(sys.argv) > 1:
-        websocket_url = sys.argv[1]
-    else:
-        websocket_url = 'ws://localhost:8001'  # Default to localhost
+    from src.game import Game
+    from src.profiler import StartupProfiler
+    from src.true_client import Player
 
-    player = Player(websocket_url)
+    startup = StartupProfiler(started)
+    startup.lap("imports")
+
+    loop = asyncio.new_event_loop()
+    ws_thread = threading.Thread(target=loop.run_forever)
+    player = Player(args.websocket_url, move_rate=args.move_rate, datagrams=not args.no_datagrams)
+    game = None
 
     try:
+        # Connect while the window is being set up, rather than before it
         ws_thread.start()
-        asyncio.run_coroutine_threadsafe(main(), loop)
-
+        connection = asyncio.run_coroutine_threadsafe(main(), loop)
         print("Connecting...")
-        while player.pid is None:
-            time.sleep(0.25)
-        print("Starting client")
 
+        game = Game()
+        startup.lap("game init")
         player.attach(game)
+        startup.lap("client ui")
+
+        while not player.connected.wait(0.5):
+            if connection.done():
+                connection.result()  # Raises the reason the connection failed
+                raise ConnectionError("Disconnected before getting a player ID")
+        startup.lap("server handshake")
+        print("Starting client")
+
         game.add_sprite(-1, player)
         game.add_handler(player.on_event, pygame.KEYUP, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN)
 
+        if args.profile_startup:
+            game.start(frames=1)
+            startup.lap("first frame")
+            startup.report()
+            game.quit()
+            raise KeyboardInterrupt()
+
         game.start()
     except KeyboardInterrupt:
         player.running = False
-        game.running = False
+        if game is not None:
+            game.running = False
         loop.call_soon_threadsafe(loop.stop)
         ws_thread.join(1)
         if ws_thread.is_alive():
@@ -52,7 +93,8 @@ if __name__ == "__main__":
     except Exception as _e:  # noqa: F841
         print("Out:", traceback.format_exc())
         player.running = False
-        game.running = False
+        if game is not None:
+            game.running = False
         loop.call_soon_threadsafe(loop.stop)
         ws_thread.join(1)
         if ws_thread.is_alive():
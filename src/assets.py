@@ -0,0 +1,158 @@
+import hashlib
+import json
+import mmap
+import struct
+from pathlib import Path
+from typing import Optional, Union
+
+import pygame
+
+PACK_PATH = Path("sprites/assets.pack")
+AUDIO_FOLDER = Path("src/audio")
+
+MAGIC = b"GGPACK01"
+HEADER = struct.Struct("<8sI")  # magic, index length
+ATLAS_COLUMNS = 8
+
+
+def tiles_version(tiles: dict) -> str:
+    """Fingerprint a tile table, so a pack baked from an older table is not used."""
+    return hashlib.sha1(json.dumps(tiles, sort_keys=True).encode()).hexdigest()
+
+
+class AssetPack:
+    """
+    A baked asset file, memory-mapped for fast loading
+
+    Holds every tile used by ImportantSprites packed into one raw RGB atlas,
+    and every sound of the audio folder already decoded to the mixer's format.
+    Build one with `python -m src.assets`.
+    """
+
+    def __init__(self, path: Union[str, Path] = PACK_PATH):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, index_length = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not an asset pack")
+
+        self.index = json.loads(self._mmap[HEADER.size:HEADER.size + index_length])
+        self._data_start = HEADER.size + index_length
+        self._atlas = None
+
+    def _blob(self, offset: int, length: int) -> memoryview:
+        """Get a view of some of the pack's data, without copying it."""
+        start = self._data_start + offset
+        return memoryview(self._mmap)[start:start + length]
+
+    def has_tiles(self, tiles: dict) -> bool:
+        """Check whether the pack was baked from this tile table."""
+        return self.index["tiles_version"] == tiles_version(tiles)
+
+    def atlas(self) -> pygame.Surface:
+        """The tile atlas, converted to the display format on first use."""
+        if self._atlas is None:
+            atlas = self.index["atlas"]
+            pixels = self._blob(atlas["offset"], atlas["length"])
+            self._atlas = pygame.image.frombuffer(pixels, atlas["size"], "RGB").convert()
+        return self._atlas
+
+    def tile(self, name: str) -> pygame.Surface:
+        """Copy a single tile out of the atlas."""
+        x, y, width, height, colorkey = self.index["tiles"][name]
+        image = self.atlas().subsurface((x, y, width, height)).copy()
+        if colorkey:
+            image.set_colorkey(colorkey, pygame.RLEACCEL)
+        return image
+
+    def has_sounds(self, folder: Union[str, Path] = AUDIO_FOLDER) -> bool:
+        """Check whether an audio folder was baked, for the mixer's current format."""
+        audio = self.index["audio"]
+        return Path(audio["folder"]) == Path(folder) and tuple(audio["format"]) == pygame.mixer.get_init()
+
+    def sound(self, name: str) -> pygame.mixer.Sound:
+        """Load a single pre-decoded sound."""
+        offset, length = self.index["audio"]["sounds"][name]
+        return pygame.mixer.Sound(buffer=self._blob(offset, length))
+
+
+_pack = None
+_pack_checked = False
+
+
+def get_pack() -> Optional[AssetPack]:
+    """Open the baked asset pack the first time it's needed, if one exists."""
+    global _pack, _pack_checked
+
+    if not _pack_checked:
+        _pack_checked = True
+        if PACK_PATH.exists():
+            try:
+                _pack = AssetPack(PACK_PATH)
+            except (OSError, ValueError) as e_mess:
+                print("Ignoring asset pack:", e_mess)
+    return _pack
+
+
+def bake(path: Union[str, Path] = PACK_PATH, audio_folder: Union[str, Path] = AUDIO_FOLDER):
+    """
+    Extract every tile and sound into a single asset pack
+
+    Requires an initialised display and mixer.
+    """
+    from .sprites import ImportantSprites
+
+    names = list(ImportantSprites.TILES)
+    textures = [ImportantSprites._make_texture(name, use_pack=False) for name in names]
+    tile_width = max(texture.get_width() for texture in textures)
+    tile_height = max(texture.get_height() for texture in textures)
+    rows = -(-len(textures) // ATLAS_COLUMNS)
+
+    atlas = pygame.Surface((tile_width * ATLAS_COLUMNS, tile_height * rows)).convert()
+    tiles = {}
+    for i, (name, texture) in enumerate(zip(names, textures)):
+        x = (i % ATLAS_COLUMNS) * tile_width
+        y = (i // ATLAS_COLUMNS) * tile_height
+        # Blit without the colorkey, the keyed pixels are needed to rebuild it
+        colorkey = texture.get_colorkey()
+        texture.set_colorkey(None)
+        atlas.blit(texture, (x, y))
+        tiles[name] = [x, y, texture.get_width(), texture.get_height(), colorkey and list(colorkey[:3])]
+
+    blobs = [pygame.image.tostring(atlas, "RGB")]
+    index = {
+        "tiles_version": tiles_version(ImportantSprites.TILES),
+        "atlas": {"offset": 0, "length": len(blobs[0]), "size": atlas.get_size()},
+        "tiles": tiles,
+        "audio": {"folder": str(audio_folder), "format": pygame.mixer.get_init(), "sounds": {}},
+    }
+
+    offset = len(blobs[0])
+    for audio_file in Path(audio_folder).iterdir():
+        if str(audio_file).endswith(".wav"):
+            raw = pygame.mixer.Sound(audio_file).get_raw()
+            index["audio"]["sounds"][audio_file.name] = [offset, len(raw)]
+            blobs.append(raw)
+            offset += len(raw)
+
+    encoded_index = json.dumps(index).encode()
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(encoded_index)))
+        f.write(encoded_index)
+        for blob in blobs:
+            f.write(blob)
+
+    return index
+
+
+if __name__ == "__main__":
+    import os
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+
+    index = bake()
+    print(f"Baked {len(index['tiles'])} tiles and {len(index['audio']['sounds'])} sounds into {PACK_PATH}")
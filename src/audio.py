@@ -0,0 +1,167 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Union
+
+import pygame
+
+from . import assets
+
+
+class SoundBank:
+    """
+    The sounds of an audio folder, loaded in the background the first time they're played
+
+    Loaded sounds are kept within a memory budget, evicting the least recently played.
+    Sounds play on a fixed pool of mixer channels: once every channel is busy, a new sound
+    steals the channel of the oldest sound with the same or a lower priority, or is dropped.
+    Plays of the same sound requested within one frame are merged into one.
+    """
+
+    def __init__(
+        self,
+        folder: Union[str, Path] = assets.AUDIO_FOLDER,
+        budget: int = 32 * 2**20,
+        channels: int = 8,
+        max_delay: float = 0.25,
+    ):
+        self.folder = Path(folder)
+        self.budget = budget  # Bytes of decoded audio to keep loaded
+        self.max_delay = max_delay  # Seconds a play can wait for its sound to load before it's dropped
+        self.enabled = pygame.mixer.get_init() is not None
+
+        pack = assets.get_pack()
+        self._pack = pack if self.enabled and pack is not None and pack.has_sounds(self.folder) else None
+        if self._pack is not None:
+            self.names = list(self._pack.index["audio"]["sounds"])
+        else:
+            self.names = [audio_file.name for audio_file in self.folder.iterdir() if audio_file.suffix == ".wav"]
+        self._known = set(self.names)
+
+        self.memory = 0
+        self._loaded: OrderedDict[str, pygame.mixer.Sound] = OrderedDict()  # Least recently played first
+        self._sizes = {}
+        self._loading: dict[str, Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sound-loader")
+        self._queued = {}  # name -> priority, for plays requested this frame
+        self._waiting = {}  # name -> (priority, time requested), for plays waiting on a load
+
+        self.channels = []
+        self._voices = []  # (priority, time started) of what each channel is playing
+        if self.enabled:
+            pygame.mixer.set_num_channels(channels)
+            self.channels = [pygame.mixer.Channel(i) for i in range(channels)]
+            self._voices = [(0, 0.0)] * channels
+
+    def keys(self) -> list[str]:
+        """The names of every sound in the folder, loaded or not."""
+        return self.names
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._known
+
+    @property
+    def pending(self) -> bool:
+        """Whether any play is still waiting for its sound to load."""
+        return bool(self._queued or self._waiting)
+
+    def preload(self, *names: str) -> None:
+        """Start loading sounds in the background before they're first played."""
+        for name in names or self.names:
+            self._request(name)
+
+    def play(self, name: str, priority: int = 0) -> None:
+        """Queue a sound to start on the next update, loading it first if needed."""
+        if not self.enabled:
+            return
+        if name not in self._known:
+            print("Unknown sound", name)
+            return
+        self._queued[name] = max(priority, self._queued.get(name, priority))
+
+    def update(self) -> None:
+        """Start the sounds queued this frame and the ones that finished loading, once a frame."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self._collect()
+
+        queued, self._queued = self._queued, {}
+        for name, priority in queued.items():
+            if name in self._loaded:
+                self._start(name, priority, now)
+            else:
+                self._request(name)
+                waiting_priority, requested = self._waiting.get(name, (priority, now))
+                self._waiting[name] = (max(priority, waiting_priority), requested)
+
+        for name, (priority, requested) in list(self._waiting.items()):
+            if name in self._loaded:
+                del self._waiting[name]
+                self._start(name, priority, now)
+            elif now - requested > self.max_delay or name not in self._loading:
+                # Too late to still sound like a response, or it failed to load
+                del self._waiting[name]
+
+    def close(self) -> None:
+        """Stop loading sounds."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _request(self, name: str) -> None:
+        if name not in self._loaded and name not in self._loading:
+            self._loading[name] = self._executor.submit(self._load, name)
+
+    def _load(self, name: str) -> pygame.mixer.Sound:
+        """Decode a sound, on the loader thread."""
+        if self._pack is not None:
+            return self._pack.sound(name)
+        return pygame.mixer.Sound(self.folder / name)
+
+    def _collect(self) -> None:
+        """Take in the sounds that finished loading, then evict down to the budget."""
+        for name, future in list(self._loading.items()):
+            if not future.done():
+                continue
+            del self._loading[name]
+            try:
+                sound = future.result()
+            except (pygame.error, OSError) as e_mess:
+                print("Couldn't load sound", name, e_mess)
+                continue
+
+            frequency, sample_format, channels = pygame.mixer.get_init()
+            self._sizes[name] = int(sound.get_length() * frequency) * channels * abs(sample_format) // 8
+            self._loaded[name] = sound
+            self.memory += self._sizes[name]
+
+        if self.memory > self.budget:
+            self._evict()
+
+    def _evict(self) -> None:
+        playing = {channel.get_sound() for channel in self.channels if channel.get_busy()}
+        for name in list(self._loaded):
+            if self.memory <= self.budget:
+                break
+            if self._loaded[name] in playing:
+                continue
+            del self._loaded[name]
+            self.memory -= self._sizes.pop(name)
+
+    def _channel_for(self, priority: int) -> Optional[int]:
+        """Pick a free channel, or the one to steal for a sound of this priority."""
+        stealable = None
+        for i, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                return i
+            if self._voices[i][0] <= priority and (stealable is None or self._voices[i] < self._voices[stealable]):
+                stealable = i
+        return stealable
+
+    def _start(self, name: str, priority: int, now: float) -> None:
+        self._loaded.move_to_end(name)
+        i = self._channel_for(priority)
+        if i is None:
+            return
+        self.channels[i].play(self._loaded[name])
+        self._voices[i] = (priority, now)
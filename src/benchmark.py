@@ -0,0 +1,113 @@
+import argparse
+import random
+import sys
+import time
+
+import pygame
+
+from .game import Game
+from .profiler import FrameProfiler
+from .true_client import Player
+
+
+class Wanderer:
+    """Drives characters around randomly, standing in for players' input."""
+
+    def __init__(self, characters: list, seed: int = 0, interval: float = 0.5):
+        self.characters = characters
+        self.random = random.Random(seed)
+        self.interval = interval
+        self.elapsed = interval
+
+    def update(self, screen: pygame.Surface, dt: float) -> list[pygame.Rect]:
+        """Give every character a new random direction every interval."""
+        self.elapsed += dt
+        if self.elapsed >= self.interval:
+            self.elapsed = 0
+            for character in self.characters:
+                character.direction = (self.random.choice((-1, 0, 1)), self.random.choice((-1, 0, 1)))
+        return []
+
+
+class Chatter:
+    """Posts a chat message every few frames, so the chat UI keeps redrawing."""
+
+    def __init__(self, player: Player, every: int = 30):
+        self.player = player
+        self.every = every
+        self.frame = 0
+
+    def update(self, screen: pygame.Surface, dt: float) -> list[pygame.Rect]:
+        """Post the next chat message when it's due."""
+        self.frame += 1
+        if self.frame % self.every == 0:
+            self.player.texts.append(f"Player {self.frame % 4}: message {self.frame}")
+        return []
+
+
+def run(frames: int, characters: int, seed: int) -> tuple[Game, float]:
+    """
+    Run a headless game with a map, some characters and the chat UI, for a number of frames
+
+    Returns the game and how long its mainloop ran for.
+    """
+    game = Game(headless=True)
+    game.framerate = 0  # Unlimited
+    game.profiler = FrameProfiler(window=frames)
+
+    player = Player()
+    player.pid = 0
+    player.attach(game)
+    game.add_sprite(-1, player)
+    player.start_game_client(str(seed))
+
+    for pid in range(1, characters + 1):
+        player.update_character(str(pid), 0, 0)
+    spawner = random.Random(seed)
+    world_width, world_height = game.camera.world_size
+    for character in player.characters.values():
+        character.x, character.y = spawner.randrange(world_width), spawner.randrange(world_height)
+
+    player.character = player.make_character(player.pid)
+    game.camera.follow(player.character)
+    game.add_sprite(3, player.character)
+
+    game.add_sprite(10, Wanderer([player.character, *player.characters.values()], seed))
+    game.add_sprite(10, Chatter(player))
+
+    start = time.perf_counter()
+    game.start(frames)
+    return game, time.perf_counter() - start
+
+
+def report(game: Game, elapsed: float) -> float:
+    """Print frame rate and per-stage timings, returning the frames per second."""
+    profiler = game.profiler
+    frames = len(profiler.frame_times)
+    fps = frames / elapsed
+
+    p50, p95, p99 = (1000 * value for value in profiler.percentiles(0.5, 0.95, 0.99))
+    print(f"{frames} frames in {elapsed:.2f}s: {fps:.1f} frames/sec")
+    print(f"frame ms: p50 {p50:.3f}  p95 {p95:.3f}  p99 {p99:.3f}")
+    print(f"mean screen coverage updated: {100 * game.compositor.average_coverage():.2f}%")
+    print("mean ms per frame by stage:")
+    for name, mean in profiler.top_offenders(count=15):
+        print(f"  {1000 * mean:8.3f}  {name}")
+    return fps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark client rendering in a headless game.")
+    parser.add_argument("--frames", type=int, default=600, help="number of frames to render")
+    parser.add_argument("--characters", type=int, default=20, help="number of remote characters")
+    parser.add_argument("--seed", type=int, default=1234, help="world seed")
+    parser.add_argument("--min-fps", type=float, default=None, help="exit with an error below this frame rate")
+    args = parser.parse_args()
+
+    game, elapsed = run(args.frames, args.characters, args.seed)
+    fps = report(game, elapsed)
+    game.quit()
+
+    if args.min_fps is not None and fps < args.min_fps:
+        print(f"Frame rate regression: {fps:.1f} < {args.min_fps} frames/sec")
+        sys.exit(1)
@@ -0,0 +1,73 @@
+from typing import Optional
+
+import pygame
+
+
+class Camera:
+    """
+    A viewport onto a world that may be larger than the screen
+
+    Converts between world and screen coordinates, and follows a target sprite,
+    scrolling only once it leaves a dead zone in the middle of the viewport.
+    """
+
+    def __init__(self, viewport: pygame.Rect, world_size: Optional[tuple[int, int]] = None, dead_zone: float = 0.5):
+        self.viewport = pygame.Rect(viewport)
+        self.world_size = world_size or self.viewport.size
+        self.dead_zone = dead_zone
+        self.offset_x = 0
+        self.offset_y = 0
+        self.target = None
+
+    def follow(self, target: Optional[object]) -> None:
+        """Keep a sprite with world x and y coordinates in view."""
+        self.target = target
+
+    @property
+    def visible_rect(self) -> pygame.Rect:
+        """The area of the world currently in view, in world coordinates."""
+        return pygame.Rect(self.offset_x, self.offset_y, self.viewport.w, self.viewport.h)
+
+    def update(self) -> bool:
+        """Scroll towards the followed sprite, returning whether the view moved."""
+        if self.target is None:
+            return False
+
+        offset_x = self._follow_axis(self.target.x, self.offset_x, self.viewport.w, self.world_size[0])
+        offset_y = self._follow_axis(self.target.y, self.offset_y, self.viewport.h, self.world_size[1])
+        moved = (offset_x, offset_y) != (self.offset_x, self.offset_y)
+        self.offset_x, self.offset_y = offset_x, offset_y
+        return moved
+
+    def _follow_axis(self, position: float, offset: int, view: int, world: int) -> int:
+        """Scroll one axis just enough to keep the target inside the dead zone, within the world."""
+        margin = view * (1 - self.dead_zone) / 2
+        if position < offset + margin:
+            offset = position - margin
+        elif position > offset + view - margin:
+            offset = position - view + margin
+        return int(max(0, min(offset, world - view)))
+
+    def world_to_screen(self, x: float, y: float) -> tuple[int, int]:
+        """Convert a world position to a screen position."""
+        return int(x) - self.offset_x + self.viewport.x, int(y) - self.offset_y + self.viewport.y
+
+    def screen_to_world(self, x: float, y: float) -> tuple[int, int]:
+        """Convert a screen position to a world position."""
+        return int(x) + self.offset_x - self.viewport.x, int(y) + self.offset_y - self.viewport.y
+
+    def apply(self, rect: pygame.Rect) -> pygame.Rect:
+        """Move a world rect to where it appears on screen."""
+        return rect.move(self.viewport.x - self.offset_x, self.viewport.y - self.offset_y)
+
+    def is_visible(self, rect: pygame.Rect) -> bool:
+        """Check whether a world rect is at least partly in view."""
+        return self.visible_rect.colliderect(rect)
+
+    def visible_tiles(self, tile_size: int, columns: int, rows: int) -> tuple[range, range]:
+        """The column and row ranges of a tile grid that intersect the view."""
+        view = self.visible_rect
+        return (
+            range(max(0, view.left // tile_size), min(columns, -(-view.right // tile_size))),
+            range(max(0, view.top // tile_size), min(rows, -(-view.bottom // tile_size))),
+        )
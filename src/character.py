@@ -1,7 +1,10 @@
+import weakref
+from functools import partial
 from random import randint
 
 import pygame
 
+from .entities import Column, EntityStore
 from .sprites import ImportantSprites
 
 
@@ -13,11 +16,24 @@ class Character(pygame.sprite.Sprite):
     character creation process if desired.
     Base stats:  strength, vitality, intelligene, dexterity
     Derived stats:  health, health regen rate, mana, mana regen rate, base armor, damage multiplier
+    Position, movement, health and mana live in a row of an EntityStore, which moves and
+    regenerates every character at once.
     """
 
+    MOVEMENT_KEYS = (pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d)
     REGEN_INTERVAL = 1.0  # health/mana regen interval in seconds
     STAT_MAX = 18  # as if rolling 3d6 for stats
 
+    health = Column("health", "Current health")
+    base_health = Column("base_health", "Health regenerates up to this")
+    health_regen = Column("health_regen", "Health regenerated per second")
+    mana = Column("mana", "Current mana")
+    base_mana = Column("base_mana", "Mana regenerates up to this")
+    mana_regen = Column("mana_regen", "Mana regenerated per second")
+    regen_speed = Column("regen_speed", "Multiplier of health and mana regen")
+    movement_speed = Column("speed", "Movement speed, in pixels per second")
+    moved = Column("moved", "Whether the character moved in the last simulation step")
+
     def __init__(
         self,
         spawn_position: tuple = (0, 0),
@@ -34,15 +50,20 @@ class Character(pygame.sprite.Sprite):
         dexterity: int = None,
         movement_speed: int = 50,  # pixels per second
         regen: int = 1.5,
-        items: list = []
+        items: list = [],
+        store: EntityStore = None,
     ) -> None:
         """
         Character initialization.  Generates random base stats if not provided upon creating the class instance.
 
         Base stats should be integers between 3 and 18 (3d6).
         """
-        self.__x = x
-        self.__y = y
+        self.store = store if store is not None else EntityStore.default()
+        self.row = self.store.allocate(x=x, y=y, max_x=max_x, max_y=max_y, speed=movement_speed, regen=True)
+        # The row is freed along with the character
+        self._finalizer = weakref.finalize(self, self.store.release, self.row)
+        self.store.views[self.row] = self
+        self._special_input = None
         self.__dx = dx
         self.__dy = dy
         self.__strength = self.roll_stat(strength)
@@ -50,21 +71,16 @@ class Character(pygame.sprite.Sprite):
         self.__intel = self.roll_stat(intel)
         self.__dexterity = self.roll_stat(dexterity)
         self.__items = items
-        self.max_x = max_x
-        self.max_y = max_y
         self.update_derived_stats()
-        self._regen = True  # Health and mana regeneration are on by default
         self.regen_speed = regen
 
         self.sprites = ImportantSprites()
+        # Shared texture, already colorkeyed by the sprite cache
         self.image = self.sprites.get_character1()
-        self.image.set_colorkey((34, 35, 35))
         self.rect = self.image.get_rect(topleft=spawn_position)
-        self.direction = pygame.math.Vector2()
         self.character_index = character_index
-        self.movement_speed = movement_speed
         self.x, self.y = spawn_position
-        self.special_input = lambda x: None
+        self.camera = None
 
     def input(self, event) -> None:
         """
@@ -72,53 +88,64 @@ class Character(pygame.sprite.Sprite):
 
         handles the key event
         """
+        store, row = self.store, self.row
         if event.type == pygame.KEYUP:
             if event.key == pygame.K_w or event.key == pygame.K_s:
-                self.direction.y = 0
+                store.dir_y[row] = 0
             elif event.key == pygame.K_a or event.key == pygame.K_d:
-                self.direction.x = 0
+                store.dir_x[row] = 0
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_w:
-                self.direction.y = -1
+                store.dir_y[row] = -1
             elif event.key == pygame.K_s:
-                self.direction.y = 1
+                store.dir_y[row] = 1
             elif event.key == pygame.K_a:
-                self.direction.x = -1
+                store.dir_x[row] = -1
             elif event.key == pygame.K_d:
-                self.direction.x = 1
+                store.dir_x[row] = 1
 
-    def move(self, speed: int, dt: float):
-        """
-        Manages the move
+    @property
+    def special_input(self) -> callable:
+        """Called with the character after each step it moved in, such as to update other clients."""
+        return self._special_input or (lambda character: None)
 
-        It moves the sprite to certain direction based on key input and speed
-        """
-        if self.direction.magnitude() != 0:
-            self.direction = self.direction.normalize()
-        self.last_x = self.x
-        self.last_y = self.y
-        # += behaves badly with properties and breaks the float property
-        self.x = self.__x + self.direction.x * speed * dt
-        self.y = self.__y + self.direction.y * speed * dt
-        self.rect.center = (self.x, self.y)
-        # Update position on other clients!
-        if self.x != self.last_x or self.y != self.last_y:
-            self.special_input(self)
-
-    def update(self, screen: pygame.Surface, dt: float) -> None:
+    @special_input.setter
+    def special_input(self, func: callable) -> None:
+        self._special_input = func
+        # The store only holds a proxy, so it doesn't keep the character alive
+        self.store.watch(self.row, func and partial(func, weakref.proxy(self)))
+
+    @property
+    def active(self) -> bool:
+        """Whether the character is moving, and so needs redrawing."""
+        store, row = self.store, self.row
+        return bool(store.dir_x[row] or store.dir_y[row] or store.moved[row])
+
+    def release(self) -> None:
+        """Free the character's row in the store straight away, rather than once it's garbage collected."""
+        self._finalizer()
+
+    def update(self, screen: pygame.Surface, dt: float) -> list[pygame.Rect]:
         """
-        Update character stats and position.
+        Draw the character, interpolated between its last two simulation steps by the store.
 
         Parameter dt is elapsed time since last update, in seconds.
-        Returns True if health <= 0
         """
-        self.regen(self.regen_speed)
-
-        self.move(self.movement_speed, dt)
-        screen.blit(self.image, self.rect, (self.character_index * 1,
-                                            self.character_index * 1,
-                                            16, 16))
-        return [self.rect]
+        self.rect.center = (int(self.store.draw_x[self.row]), int(self.store.draw_y[self.row]))
+
+        area = pygame.Rect(self.character_index * 1, self.character_index * 1, 16, 16)
+        if self.camera is None:
+            rect = self.rect
+        elif self.camera.is_visible(self.rect):
+            # Clipped to the viewport, so the part hanging over its edge isn't drawn on the ui
+            unclipped = self.camera.apply(self.rect)
+            rect = unclipped.clip(self.camera.viewport)
+            area = pygame.Rect(area.x + rect.x - unclipped.x, area.y + rect.y - unclipped.y, rect.w, rect.h)
+        else:
+            return []  # Culled, out of view
+
+        screen.blit(self.image, rect, area)
+        return [rect]
 
     def __str__(self):
         char_info = f"""
@@ -127,7 +154,7 @@ class Character(pygame.sprite.Sprite):
             health {self.health} health regen {self.health_regen}
             mana {self.mana} mana regen {self.mana_regen}
             armor {self.armor} damage mult {self.damage_multiplier}
-            regen state {self._regen}
+            regen state {bool(self.store.regen[self.row])}
             items {self.items}
         """
         return char_info
@@ -139,22 +166,54 @@ class Character(pygame.sprite.Sprite):
     @property
     def x(self) -> int:
         """Returns x coordinate as integer"""
-        return int(self.__x) % self.max_x
+        return int(self.store.x[self.row])
 
     @x.setter
     def x(self, value: int) -> None:
-        """Set x coordinate"""
-        self.__x = value
+        """Set x coordinate, wrapped to within max_x"""
+        self.store.x[self.row] = value % self.max_x
+        self.store.touch(self.row)
 
     @property
     def y(self) -> int:
         """Returns y coordinate as integer"""
-        return int(self.__y) % self.max_y
+        return int(self.store.y[self.row])
 
     @y.setter
     def y(self, value: int) -> None:
-        """Set y coordinate"""
-        self.__y = value
+        """Set y coordinate, wrapped to within max_y"""
+        self.store.y[self.row] = value % self.max_y
+        self.store.touch(self.row)
+
+    @property
+    def max_x(self) -> int:
+        """Returns the width x coordinates wrap around at"""
+        return int(self.store.max_x[self.row])
+
+    @max_x.setter
+    def max_x(self, value: int) -> None:
+        """Set the width x coordinates wrap around at"""
+        self.store.max_x[self.row] = value
+
+    @property
+    def max_y(self) -> int:
+        """Returns the height y coordinates wrap around at"""
+        return int(self.store.max_y[self.row])
+
+    @max_y.setter
+    def max_y(self, value: int) -> None:
+        """Set the height y coordinates wrap around at"""
+        self.store.max_y[self.row] = value
+
+    @property
+    def direction(self) -> pygame.math.Vector2:
+        """Returns a copy of the movement direction"""
+        return pygame.math.Vector2(self.store.dir_x[self.row], self.store.dir_y[self.row])
+
+    @direction.setter
+    def direction(self, value: tuple[float, float]) -> None:
+        """Set the movement direction, normalised when moving"""
+        self.store.dir_x[self.row], self.store.dir_y[self.row] = value
 
     @property
     def dx(self) -> float:
@@ -257,10 +316,11 @@ class Character(pygame.sprite.Sprite):
 
     def toggle_regen(self, state: bool = None) -> None:
         """Turns regeneration on or off (True/False), or toggles current value with no parameter"""
-        self._regen = not self._regen if state is None else state
+        store, row = self.store, self.row
+        store.regen[row] = not store.regen[row] if state is None else state
 
     def regen(self, dt: float) -> None:
-        """Update health and mana if regen is active"""
-        if self._regen:
-            self.health = min(self.health + dt * self.health_regen, self.base_health)
-            self.mana = min(self.mana + dt * self.mana_regen, self.base_mana)
+        """Update health and mana if regen is active, outside of the store's batched steps"""
+        if self.store.regen[self.row]:
+            self.health = min(self.health + dt * self.regen_speed * self.health_regen, self.base_health)
+            self.mana = min(self.mana + dt * self.regen_speed * self.mana_regen, self.base_mana)
@@ -0,0 +1,97 @@
+from collections import deque
+from typing import NamedTuple
+
+import pygame
+
+
+class FrameUpdate(NamedTuple):
+    """What a single frame pushed to the display."""
+
+    rects_in: int
+    rects_out: int
+    area: int
+    coverage: float
+    full: bool
+
+
+class Compositor:
+    """
+    Coalesces the dirty rects of a frame before they're pushed to the display
+
+    Rects are clipped to the screen, rects contained in others are dropped,
+    and overlapping or adjacent rects are merged when their union wastes
+    little area. Past a coverage threshold the whole display is flipped.
+    """
+
+    def __init__(self, screen_rect: pygame.Rect, flip_threshold: float = 0.6, merge_slack: float = 0.1):
+        self.screen_rect = pygame.Rect(screen_rect)
+        self.flip_threshold = flip_threshold
+        self.merge_slack = merge_slack
+        self.history = deque(maxlen=120)
+
+    @property
+    def last(self) -> FrameUpdate:
+        """Stats of the most recently presented frame."""
+        return self.history[-1] if self.history else FrameUpdate(0, 0, 0, 0.0, False)
+
+    def average_coverage(self) -> float:
+        """Mean fraction of the screen updated per frame over recent frames."""
+        if not self.history:
+            return 0.0
+        return sum(update.coverage for update in self.history) / len(self.history)
+
+    def coalesce(self, rects: list[pygame.Rect]) -> list[pygame.Rect]:
+        """Merge a frame's dirty rects into as few, as small, rects as reasonable."""
+        # Exact duplicates are common, such as a restored rect and a stationary sprite's rect
+        unique = {tuple(self.screen_rect.clip(rect)) for rect in rects}
+        # Largest first, so contained rects are always checked against their container
+        clipped = sorted(
+            (pygame.Rect(rect) for rect in unique if rect[2] and rect[3]),
+            key=lambda rect: rect.w * rect.h,
+            reverse=True,
+        )
+
+        kept = []
+        for rect in clipped:
+            if not any(kept[i].contains(rect) for i in rect.collidelistall(kept)):
+                kept.append(rect)
+
+        merged = True
+        while merged:
+            merged = False
+            out = []
+            for rect in kept:
+                # Only rects touching this one can merge with it
+                for i in rect.inflate(2, 2).collidelistall(out):
+                    other = out[i]
+                    union = other.union(rect)
+                    overlap = other.clip(rect)
+                    covered = other.w * other.h + rect.w * rect.h - overlap.w * overlap.h
+                    union_area = union.w * union.h
+                    if union_area - covered <= self.merge_slack * union_area:
+                        out[i] = union
+                        merged = True
+                        break
+                else:
+                    out.append(rect)
+            kept = out
+
+        return kept
+
+    def present(self, rects: list[pygame.Rect]) -> FrameUpdate:
+        """Push a frame's dirty rects to the display, and record how much was updated."""
+        merged = self.coalesce(rects)
+        screen_area = self.screen_rect.w * self.screen_rect.h
+        area = min(sum(rect.w * rect.h for rect in merged), screen_area)
+        coverage = area / screen_area
+        full = coverage >= self.flip_threshold
+
+        if full:
+            pygame.display.flip()
+            area, coverage = screen_area, 1.0
+        elif merged:
+            pygame.display.update(merged)
+
+        update = FrameUpdate(len(rects), len(merged), area, coverage, full)
+        self.history.append(update)
+        return update
@@ -0,0 +1,50 @@
+import asyncio
+from typing import Callable, Optional
+
+DATAGRAM_PORT = 8002
+MAX_DATAGRAM = 1200  # Bytes, small enough to get through without being split up on the way
+
+
+class DatagramChannel(asyncio.DatagramProtocol):
+    """
+    A UDP endpoint for movement, passing each datagram it receives to a function
+
+    Movement only needs the newest position, so it's better lost than late. Over the
+    websocket, one lost packet holds back everything sent after it until it's resent, but
+    datagrams arrive on their own, so a lost one just leaves a gap until the next.
+    Datagrams can also arrive out of order, so each kind of message carries a sequence
+    number or time, and receivers drop ones older than what they have.
+    """
+
+    def __init__(self, receive: Callable[[str, tuple], None]):
+        self.receive = receive
+        self.transport = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        """Keep the transport to send with."""
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address: tuple) -> None:
+        """Pass a datagram on as text, along with where it came from."""
+        try:
+            message = data.decode()
+        except UnicodeDecodeError:
+            return  # Not one of ours
+        self.receive(message, address)
+
+    def error_received(self, exc: Exception) -> None:
+        """Report errors, such as the other end not listening, which don't stop anything."""
+        print("Datagram error:", exc)
+
+    def send(self, message: str, address: Optional[tuple] = None) -> bool:
+        """Send a message in one datagram, returning whether it could be sent."""
+        data = message.encode()
+        if self.transport is None or self.transport.is_closing() or len(data) > MAX_DATAGRAM:
+            return False
+        self.transport.sendto(data, address)
+        return True
+
+    def close(self) -> None:
+        """Stop sending and receiving."""
+        if self.transport is not None:
+            self.transport.close()
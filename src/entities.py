@@ -0,0 +1,232 @@
+import weakref
+from typing import Callable, Optional
+
+import numpy as np
+
+# Per entity columns, and their types
+FIELDS = {
+    "x": np.float64,
+    "y": np.float64,
+    "prev_x": np.float64,  # Position at the start of the last step, for interpolation
+    "prev_y": np.float64,
+    "draw_x": np.float64,  # Position interpolated between the last two steps, to draw at
+    "draw_y": np.float64,
+    "dir_x": np.float64,
+    "dir_y": np.float64,
+    "speed": np.float64,  # pixels per second
+    "max_x": np.float64,  # Positions wrap around at these bounds
+    "max_y": np.float64,
+    "health": np.float64,
+    "base_health": np.float64,
+    "health_regen": np.float64,
+    "mana": np.float64,
+    "base_mana": np.float64,
+    "mana_regen": np.float64,
+    "regen_speed": np.float64,
+    "regen": np.bool_,
+    "moved": np.bool_,  # Whether the entity moved in the last step
+    "alive": np.bool_,
+}
+
+
+class Column:
+    """An attribute of a view object, stored in the view's row of a store column."""
+
+    def __init__(self, name: str, doc: Optional[str] = None):
+        self.name = name
+        self.__doc__ = doc
+
+    def __get__(self, view: object, owner: type = None):
+        if view is None:
+            return self
+        return getattr(view.store, self.name)[view.row].item()
+
+    def __set__(self, view: object, value) -> None:
+        getattr(view.store, self.name)[view.row] = value
+
+
+class EntityStore:
+    """
+    Position, movement and stats of many entities, kept as one NumPy array per field
+
+    Each entity is a row, which can be reused once released. Movement, wrapping and
+    regeneration are stepped for every entity at once, so thousands of entities cost
+    about the same per step as a few. Objects such as Character are views over a row.
+    """
+
+    _default: Optional["EntityStore"] = None
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = 0
+        self.count = 0  # Rows in use or on the free list, every row past this is unused
+        self._free = []
+        self._listeners: list[Callable] = []
+        self._watchers: dict[int, Callable] = {}
+        self.views = weakref.WeakValueDictionary()  # row -> the object viewing it, if any
+        self.walk_mask = None  # Entities can't step onto unwalkable tiles of this map, if set
+        self._grow(capacity)
+
+    @classmethod
+    def default(cls) -> "EntityStore":
+        """The store that Characters join when not given one, stepped by every Game."""
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def _grow(self, capacity: int) -> None:
+        for name, dtype in FIELDS.items():
+            column = np.zeros(capacity, dtype)
+            if self.capacity:
+                column[:self.capacity] = getattr(self, name)
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def __len__(self) -> int:
+        return self.count - len(self._free)
+
+    def allocate(self, **values) -> int:
+        """Take a row for a new entity, with some initial field values."""
+        if self._free:
+            row = self._free.pop()
+        else:
+            if self.count == self.capacity:
+                self._grow(self.capacity * 2)
+            row = self.count
+            self.count += 1
+
+        for name in FIELDS:
+            getattr(self, name)[row] = 0
+        self.max_x[row] = self.max_y[row] = np.inf
+        for name, value in values.items():
+            getattr(self, name)[row] = value
+        self.prev_x[row] = self.draw_x[row] = self.x[row]
+        self.prev_y[row] = self.draw_y[row] = self.y[row]
+        self.alive[row] = True
+        self._notify(np.array([row]))
+        return row
+
+    def release(self, row: int) -> None:
+        """Free a row for reuse."""
+        self.alive[row] = False
+        self.dir_x[row] = self.dir_y[row] = 0
+        self.regen[row] = self.moved[row] = False
+        self._watchers.pop(row, None)
+        self._free.append(row)
+        self._notify(np.array([row]))
+
+    def place(self, rows: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> None:
+        """
+        Put rows at positions outside of a step, such as positions from the server
+
+        They're drawn there straight away, rather than interpolated to over the next step.
+        """
+        changed = np.zeros(len(rows), bool)
+        for position, previous, draw, values, bound in (
+            (self.x, self.prev_x, self.draw_x, xs, self.max_x[rows]),
+            (self.y, self.prev_y, self.draw_y, ys, self.max_y[rows]),
+        ):
+            values = np.mod(values, bound, where=np.isfinite(bound), out=np.array(values, np.float64))
+            changed |= position[rows] != values
+            position[rows] = previous[rows] = values
+            draw[rows] = np.floor(values)
+        if self._listeners and changed.any():
+            self._notify(rows[changed])
+
+    def listen(self, func: Callable[[np.ndarray], None]) -> None:
+        """
+        Call a function with the rows that moved, after each step where any did.
+
+        It's also called when a row is allocated, released or touched.
+        """
+        self._listeners.append(func)
+
+    def unlisten(self, func: Callable[[np.ndarray], None]) -> None:
+        """Stop calling a function added with listen."""
+        if func in self._listeners:
+            self._listeners.remove(func)
+
+    def touch(self, row: int) -> None:
+        """Tell listeners a row was moved outside of a step, such as by setting its position."""
+        if self._listeners:
+            self._notify(np.array([row]))
+
+    def _notify(self, rows: np.ndarray) -> None:
+        for listener in self._listeners:
+            listener(rows)
+
+    def watch(self, row: int, func: Optional[Callable[[], None]]) -> None:
+        """Call a function after each step where a row moved, or stop with None."""
+        if func is None:
+            self._watchers.pop(row, None)
+        else:
+            self._watchers[row] = func
+
+    def fixed_update(self, dt: float) -> None:
+        """Move, wrap and regenerate every entity by one step of dt seconds."""
+        n = self.count
+        x, y = self.x[:n], self.y[:n]
+        self.prev_x[:n] = x
+        self.prev_y[:n] = y
+
+        # Diagonal movement is normalised, so it isn't faster
+        dir_x, dir_y = self.dir_x[:n], self.dir_y[:n]
+        norm = np.hypot(dir_x, dir_y)
+        scale = np.divide(self.speed[:n] * dt, norm, out=np.zeros(n), where=norm > 0)
+        new_x = x + dir_x * scale
+        new_y = y + dir_y * scale
+        if self.walk_mask is not None:
+            self._collide(x, y, new_x, new_y)
+        x[:] = new_x
+        y[:] = new_y
+
+        # Wrap around, shifting the previous position along so interpolation doesn't cross the world
+        for position, previous, bound in ((x, self.prev_x[:n], self.max_x[:n]), (y, self.prev_y[:n], self.max_y[:n])):
+            wrapped = np.mod(position, bound, where=np.isfinite(bound), out=position.copy())
+            wrapped[wrapped >= bound] = 0  # Tiny negative positions can round up to the bound
+            previous += wrapped - position
+            position[:] = wrapped
+
+        moved = self.moved[:n]
+        np.logical_and((x != self.prev_x[:n]) | (y != self.prev_y[:n]), self.alive[:n], out=moved)
+
+        regen = self.regen[:n]
+        amount = dt * self.regen_speed[:n]
+        health, mana = self.health[:n], self.mana[:n]
+        health[regen] = np.minimum(health + amount * self.health_regen[:n], self.base_health[:n])[regen]
+        mana[regen] = np.minimum(mana + amount * self.mana_regen[:n], self.base_mana[:n])[regen]
+
+        if self._listeners or self._watchers:
+            rows = np.flatnonzero(moved)
+            if len(rows):
+                self._notify(rows)
+                for row, func in list(self._watchers.items()):
+                    if moved[row]:
+                        func()
+
+    def _collide(self, x: np.ndarray, y: np.ndarray, new_x: np.ndarray, new_y: np.ndarray) -> None:
+        """Stop moves onto unwalkable tiles, sliding along whichever axis is still open."""
+        n = self.count
+        mask = self.walk_mask
+        wrapped_x = np.mod(new_x, self.max_x[:n], where=np.isfinite(self.max_x[:n]), out=new_x.copy())
+        wrapped_y = np.mod(new_y, self.max_y[:n], where=np.isfinite(self.max_y[:n]), out=new_y.copy())
+
+        # Entities already on an unwalkable tile can walk off it
+        blocked = ~mask.walkable_many(wrapped_x, wrapped_y) & mask.walkable_many(x, y)
+        if not blocked.any():
+            return
+
+        only_x = blocked & mask.walkable_many(wrapped_x, y)
+        only_y = blocked & ~only_x & mask.walkable_many(x, wrapped_y)
+        stuck = blocked & ~only_x & ~only_y
+        new_y[only_x | stuck] = y[only_x | stuck]
+        new_x[only_y | stuck] = x[only_y | stuck]
+
+    def interpolate(self, alpha: float) -> None:
+        """Update the draw positions, a fraction alpha of the way through the last step."""
+        n = self.count
+        for draw, previous, position, bound in (
+            (self.draw_x[:n], self.prev_x[:n], self.x[:n], self.max_x[:n]),
+            (self.draw_y[:n], self.prev_y[:n], self.y[:n], self.max_y[:n]),
+        ):
+            np.floor(previous + (position - previous) * alpha, out=draw)
+            np.mod(draw, bound, where=np.isfinite(bound), out=draw)
@@ -1,32 +1,94 @@
 import bisect
+import itertools
+import os
+import time
 from collections import defaultdict
-from io import FileIO
-from pathlib import Path
-from typing import Union
+from typing import Optional
 
 import pygame
 
+from .camera import Camera
+from .compositor import Compositor
+from .entities import EntityStore
+from .profiler import FrameProfiler, stage_name
+from .scene import Scene
+from .spatial import SpatialHash
+
+
+class Subscription:
+    """An event handler registered with a Game, for some event types and optionally some keys."""
+
+    _order = itertools.count()
+
+    def __init__(self, game: "Game", func: callable, routes: list[tuple], priority: int, owner: object):
+        self.game = game
+        self.func = func
+        self.routes = routes
+        self.priority = priority
+        self.owner = owner
+        self.name = stage_name(func, "event")
+        # Handlers of equal priority run in the order they were added
+        self.sort_key = (-priority, next(self._order))
+
+    def cancel(self) -> None:
+        """Stop the handler from being called."""
+        self.game._unsubscribe(self)
+
 
 class Game:
     """
     A management class that maintains pygame-specific application-wide details
 
-    Such as a sorted sprite render/update list, the mainloop, and event handling.
+    Such as a layered sprite scene, the mainloop, and event handling.
     """
 
     running: bool = False
-    framerate: int = 60
-
-    def __init__(self):
-        if not pygame.get_init():
-            pygame.init()
+    framerate: int = 60  # Render frame rate cap, 0 for unlimited
+    step_rate: int = 60  # Fixed simulation steps per second
+    idle_framerate: Optional[int] = 4  # Frame rate once nothing has changed for a while, None to never throttle
+    idle_after: float = 1.0  # Seconds without input, network updates or animation before throttling
+    max_steps_per_frame: int = 5
+    headless_resolution: tuple[int, int] = (1200, 800)
+
+    def __init__(self, headless: bool = False, resolution: Optional[tuple[int, int]] = None):
+        """
+        Set up pygame and the window
 
-        self.screen = pygame.display.set_mode(self.get_nice_display_mode())
+        Headless games render to SDL's dummy video and audio drivers at a fixed
+        resolution, so they can run on servers and CI machines without a display.
+        """
+        if headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            os.environ["SDL_AUDIODRIVER"] = "dummy"
+            # The drivers are picked when their subsystems initialise
+            pygame.display.quit()
+            pygame.mixer.quit()
+            resolution = resolution or self.headless_resolution
+
+        # Initialises any pygame module that isn't already
+        pygame.init()
+
+        self.headless = headless
+        self.screen = pygame.display.set_mode(resolution or self.get_nice_display_mode())
         pygame.display.set_caption(" ")
-
-        self.event_handlers = defaultdict(list)
-        self.sprites = []
-        self.add_handler(self.quit_on_esc, pygame.KEYDOWN)
+        self.compositor = Compositor(self.screen.get_rect())
+
+        # (event type, key or None for every key) -> subscriptions, highest priority first
+        self.event_handlers: dict[tuple, tuple[Subscription]] = {}
+        self._dispatch_cache = {}
+        self._owned_handlers = defaultdict(list)
+        self.scene = Scene(self.screen.get_size())
+        self.systems = []
+        self.entities = EntityStore.default()
+        self.add_system(self.entities)
+        self.spatial = SpatialHash(self.entities)
+        self.camera = Camera(self.screen.get_rect())
+        self.profiler = FrameProfiler()
+        self.add_handler(self.quit_on_esc, pygame.KEYDOWN, keys=(pygame.K_ESCAPE,))
+        self.add_handler(self.profiler_keys, pygame.KEYDOWN, keys=(pygame.K_F3, pygame.K_F4))
+        self.wake_event = pygame.event.custom_type()
+        self.idle = False
+        self._last_activity = time.perf_counter()
 
     def get_nice_display_mode(self):
         """
@@ -57,72 +119,213 @@ class Game:
                     return mode
         return 1200, 800
 
-    def add_handler(self, func: callable, *event_types) -> None:
-        """Register an event handler, which will be called on all events of a matching type."""
-        for event_type in event_types:
-            self.event_handlers[event_type].append(func)
+    def add_handler(
+        self,
+        func: callable,
+        *event_types,
+        keys: Optional[tuple[int]] = None,
+        priority: int = 0,
+        owner: Optional[object] = None,
+    ) -> Subscription:
+        """
+        Register an event handler, which will be called on all events of a matching type.
+
+        With keys, the handler is only called for key events of those keys. Handlers with a
+        higher priority are called first, and a handler returning True stops the event there.
+        The handler is unsubscribed when its owner is removed from the game, which defaults
+        to the object a bound method belongs to.
+        """
+        routes = [(event_type, key) for event_type in event_types for key in (keys or (None,))]
+        owner = owner if owner is not None else getattr(func, "__self__", None)
+        subscription = Subscription(self, func, routes, priority, owner)
+
+        for route in routes:
+            handlers = list(self.event_handlers.get(route, ()))
+            bisect.insort(handlers, subscription, key=lambda handler: handler.sort_key)
+            self.event_handlers[route] = tuple(handlers)
+        if owner is not None:
+            self._owned_handlers[owner].append(subscription)
+        self._dispatch_cache.clear()
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        """Remove a subscription from every route it's on."""
+        for route in subscription.routes:
+            handlers = tuple(handler for handler in self.event_handlers.get(route, ()) if handler is not subscription)
+            if handlers:
+                self.event_handlers[route] = handlers
+            else:
+                self.event_handlers.pop(route, None)
+        owned = self._owned_handlers.get(subscription.owner)
+        if owned and subscription in owned:
+            owned.remove(subscription)
+            if not owned:
+                del self._owned_handlers[subscription.owner]
+        self._dispatch_cache.clear()
 
     def remove_handler(self, func: callable, *event_types) -> None:
         """Remove an event handler from the given event types so that it will no longer be called."""
-        for event_type in event_types:
-            self.event_handlers[event_type].remove(func)
+        for handlers in list(self.event_handlers.values()):
+            for subscription in handlers:
+                if subscription.func == func and any(route[0] in event_types for route in subscription.routes):
+                    subscription.cancel()
+
+    def handlers_for(self, event: pygame.event.Event) -> tuple[Subscription]:
+        """The handlers an event goes to, in call order."""
+        route = (event.type, getattr(event, "key", None))
+        handlers = self._dispatch_cache.get(route)
+        if handlers is None:
+            handlers = self.event_handlers.get((event.type, None), ())
+            if route[1] is not None and route in self.event_handlers:
+                handlers = tuple(sorted((*self.event_handlers[route], *handlers), key=lambda h: h.sort_key))
+            self._dispatch_cache[route] = handlers
+        return handlers
+
+    def add_system(self, system: object) -> None:
+        """
+        Register a system, which simulates many things at once rather than being drawn.
+
+        Systems are stepped with fixed_update(dt) before the scene's sprites each simulation
+        step, and get interpolate(alpha) each frame with how far through the next step it is.
+        """
+        self.systems.append(system)
 
     def add_sprite(self, layer: int, sprite: object) -> None:
         """Add a sprite to the game, where it will be rendered and updated each frame."""
-        # Hash is used here so sprites are never directly compared.
-        # Order shouldn't matter (provided layer ordering is preseved)
-        # although python does guarantee consistency.
-        bisect.insort(self.sprites, (layer, hash(sprite), sprite))
+        self.scene.add(layer, sprite)
 
-    def remove_sprite(self, layer: int, sprite: object):
-        """Remove a sprite from the game."""
-        self.sprites.remove((layer, hash(sprite), sprite))
+    def remove_sprite(self, sprite: object):
+        """Remove a sprite from the game, from whichever layer it is in, along with the event handlers it owns."""
+        self.scene.remove(sprite)
+        for subscription in list(self._owned_handlers.get(sprite, ())):
+            subscription.cancel()
 
-    def load_audio_folder(self, folder: Union[str, FileIO]) -> dict[str, pygame.mixer.Sound]:
+    def set_layer_static(self, layer: int, static: bool = True) -> None:
         """
-        Loads all audio file in dir to mixer Sound object
+        Mark a layer as static
 
-        Loads all the audio and returns back a dict with key as file name
-        and value as mixer.Sound object.
+        Sprites of a static layer are only updated when the layer is invalidated,
+        and are otherwise drawn from a cached composite surface.
         """
-        sound_list = {}
-        for audio_file in Path(folder).iterdir():
-            if str(audio_file).endswith(".wav"):
-                sound_list[audio_file.name] = pygame.mixer.Sound(audio_file)
+        self.scene.set_static(layer, static)
 
-        return sound_list
+    def invalidate(self, sprite: object) -> None:
+        """Have a sprite in a static layer redrawn next frame."""
+        self.scene.invalidate(sprite)
 
     def quit_on_esc(self, event: pygame.event.EventType):
         """Exit if the event is an escape keypress."""
         if event.key == pygame.K_ESCAPE:
             self.running = False
 
-    def start(self):
-        """Begin the Mainloop, managing framerate, sprites, and window events."""
+    def profiler_keys(self, event: pygame.event.EventType):
+        """Toggle the frame profiler overlay with F3, and start or stop a trace capture with F4."""
+        if event.key == pygame.K_F3:
+            self.profiler.overlay_visible = not self.profiler.overlay_visible
+            if not self.profiler.overlay_visible:
+                self.scene.invalidate_static()
+        elif event.key == pygame.K_F4:
+            path = self.profiler.toggle_tracing()
+            if path:
+                print("Wrote frame trace to", path)
+            else:
+                print("Capturing frame trace, press F4 again to save")
+
+    def wake(self) -> None:
+        """
+        Mark the game as active, such as when network data arrives
+
+        Safe to call from other threads, and interrupts an idle wait straight away.
+        """
+        self._last_activity = time.perf_counter()
+        if pygame.display.get_init():
+            pygame.event.post(pygame.event.Event(self.wake_event))
+
+    def _wait_for_frame(self, clock: pygame.time.Clock) -> list[pygame.event.Event]:
+        """Wait for the next frame, sleeping until an event or a slow tick once idle, and return the new events."""
+        self.idle = self.idle_framerate is not None and time.perf_counter() - self._last_activity > self.idle_after
+        if not self.idle:
+            clock.tick(self.framerate)
+            return pygame.event.get()
+
+        first = pygame.event.wait(1000 // self.idle_framerate)
+        clock.tick()  # Keep the clock's own timing in step
+        if first.type == pygame.NOEVENT:
+            return pygame.event.get()
+        return [first, *pygame.event.get()]
+
+    def start(self, frames: Optional[int] = None):
+        """
+        Begin the Mainloop, managing framerate, sprites, and window events.
+
+        Stops by itself after the given number of frames, if any. The window is then left
+        open, so the game can be started again, such as for a warm up then a measured run;
+        call quit() once done with it.
+        """
         self.running = True
         clock = pygame.time.Clock()
+        step = 1 / self.step_rate
+        accumulator = 0.0
+        last_frame = time.perf_counter()
 
         while self.running:
-            tick_time = clock.tick(self.framerate) / 1000
-            events = pygame.event.get()
+            if frames is not None:
+                if frames <= 0:
+                    break
+                frames -= 1
+
+            events = self._wait_for_frame(clock)
+            now = time.perf_counter()
+            tick_time = now - last_frame
+            last_frame = now
+            if self.idle:
+                # Nothing moved while idle, so there's no time to catch up on
+                tick_time = min(tick_time, step)
+
+            profiler = self.profiler
+            profiler.begin_frame()
             changed_rects = []
             for event in events:
-                handlers = self.event_handlers[event.type]
-                for handler in handlers:
-                    if handler(event):
+                for handler in self.handlers_for(event):
+                    if profiler.measure(handler.name, handler.func, event):
                         break
 
                 if event.type == pygame.QUIT:
                     self.running = False
                     break
 
-            for layer, _, sprite in self.sprites:
-                changed_rects.extend(sprite.update(self.screen, tick_time))
+            # Simulate in fixed steps, so movement doesn't depend on the frame rate.
+            # Sprites interpolate between their last two steps when drawn.
+            accumulator = min(accumulator + tick_time, self.max_steps_per_frame * step)
+            while accumulator >= step:
+                for system in self.systems:
+                    profiler.measure(stage_name(system.fixed_update, "system"), system.fixed_update, step)
+                profiler.measure("fixed update", self.scene.fixed_update, step)
+                accumulator -= step
+            for system in self.systems:
+                system.interpolate(accumulator / step)
+
+            if self.camera.update():
+                self.scene.invalidate_static()
+            changed_rects.extend(self.scene.update(self.screen, tick_time, profiler))
+
+            if profiler.overlay_visible:
+                changed_rects.append(profiler.draw_overlay(self.screen))
+
+            profiler.measure("display update", self.compositor.present, changed_rects)
+            profiler.end_frame()
+
+            if events or self.scene.active():
+                self._last_activity = now
 
-            pygame.display.update(changed_rects)
+        if frames is None:
+            self.quit()
 
+    def quit(self) -> None:
+        """Close the window and stop the sprites, once the game is done with."""
         pygame.quit()
-        for _, _, sprite in self.sprites:
+        self.spatial.close()  # The store is shared with any later game, which has its own hash
+        for sprite in self.scene:
             sprite.running = False
 
 
@@ -155,7 +358,7 @@ if __name__ == "__main__":
     from character import Character
     char = Character()
     game.add_sprite(0, char)
-    game.add_handler(char.input, pygame.KEYDOWN, pygame.KEYUP)
+    game.add_handler(char.input, pygame.KEYDOWN, pygame.KEYUP, keys=char.MOVEMENT_KEYS)
 
     game.add_handler(print, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN)
 
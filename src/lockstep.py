@@ -0,0 +1,125 @@
+from typing import Callable, Iterable
+
+import numpy as np
+import pygame
+
+from .character import Character
+from .entities import EntityStore
+from .mapgen import MAP_SHAPE, MapGen
+
+
+class Lockstep:
+    """
+    Players' characters simulated identically on every client, from inputs the server relays in turns
+
+    Clients only send the server their movement key presses and releases. The server gathers
+    them into numbered turns, each a fixed length of game time, and sends every turn to every
+    player, even turns where nothing happened. Each client plays the turns in order: the turn's
+    key events go to Character.input, then its own EntityStore is stepped by the turn length.
+    Given the same turns, every client ends up with the same positions, without sending any.
+
+    Turns also carry players joining ("+pid") and leaving ("-pid"), and map changes ("=seed"),
+    so those happen at the same point of the simulation everywhere. A player who joins late
+    is sent every turn that had something in it, and plays them through to catch up.
+    """
+
+    def __init__(
+        self,
+        seed: int,
+        turn_rate: float,
+        spawn: Callable[[int, tuple[float, float], EntityStore], Character],
+        despawn: Callable[[int, Character], None],
+        closed: int = -1,
+        max_backlog: int = 3,
+    ):
+        self.store = EntityStore()
+        self.turn_length = 1 / turn_rate
+        self.spawn = spawn  # Makes the character of a player at a position, in our store
+        self.despawn = despawn
+        self.characters: dict[int, Character] = {}
+        self.regions = None
+        self.turns: dict[int, list[str]] = {}  # Turns heard of but not played yet
+        self.closed = closed  # Every turn up to here was sent, so any we haven't heard of were empty
+        self.next_turn = 0
+        self.max_backlog = max_backlog  # Past this many turns behind, turns are played straight away
+        self.clock = 0.0  # Time waiting on the next turn
+        self.load_map(seed)
+
+    def load_map(self, seed: int) -> None:
+        """Generate the walkable tiles and spawn regions of a map, for the turns after this one."""
+        map_gen = MapGen(MAP_SHAPE, seed=seed)
+        map_gen.generate_noise()
+        map_gen.convert()
+        self.store.walk_mask = map_gen.walk_mask()
+        self.regions = map_gen.regions()
+        self.seed = map_gen.seed
+
+    def add(self, message: str) -> None:
+        """Take a Turn message, "Turn: n" followed by its entries, each after a |."""
+        turn, *entries = message.removeprefix("Turn: ").split("|")
+        turn = int(turn)
+        if turn >= self.next_turn:
+            self.turns[turn] = entries
+
+    def ready(self) -> int:
+        """How many turns in a row can be played now."""
+        count = 0
+        while self.next_turn + count in self.turns or self.next_turn + count <= self.closed:
+            count += 1
+        return count
+
+    def play_turn(self) -> None:
+        """Apply the next turn's entries, in the order the server got them, then step by a turn."""
+        for entry in self.turns.pop(self.next_turn, ()):
+            if entry.startswith("+"):
+                self.join(int(entry[1:]))
+            elif entry.startswith("-"):
+                self.leave(int(entry[1:]))
+            elif entry.startswith("="):
+                self.load_map(int(entry[1:]))
+            else:
+                pid, key, down = (int(value) for value in entry.split(","))
+                if pid in self.characters:
+                    event_type = pygame.KEYDOWN if down else pygame.KEYUP
+                    self.characters[pid].input(pygame.event.Event(event_type, key=key))
+        self.store.fixed_update(self.turn_length)
+        self.next_turn += 1
+
+    def join(self, pid: int) -> None:
+        """Spawn a player's character, at a place every client picks alike."""
+        if pid in self.characters:
+            return
+        spawner = np.random.default_rng([self.seed & 0xFFFFFFFF, pid & 0xFFFFFFFF])
+        self.characters[pid] = self.spawn(pid, self.regions.spawn_point(spawner), self.store)
+
+    def leave(self, pid: int) -> None:
+        """Remove a player's character."""
+        character = self.characters.pop(pid, None)
+        if character is not None:
+            self.despawn(pid, character)
+            character.release()
+
+    def extend(self, messages: Iterable[str]) -> None:
+        """Take several Turn messages."""
+        for message in messages:
+            self.add(message)
+
+    def fixed_update(self, dt: float) -> None:
+        """Play a turn each turn length while they keep coming, and catch up if we've fallen behind."""
+        ready = self.ready()
+        while ready > self.max_backlog:
+            self.play_turn()
+            ready -= 1
+
+        self.clock += dt
+        while ready and self.clock >= self.turn_length:
+            self.play_turn()
+            ready -= 1
+            self.clock -= self.turn_length
+        if not ready:
+            # Wait for the next turn, then play it as soon as it comes
+            self.clock = min(self.clock, self.turn_length)
+
+    def interpolate(self, alpha: float) -> None:
+        """Draw characters part of the way through the last turn, by how long until the next is due."""
+        self.store.interpolate(min(self.clock / self.turn_length, 1.0))
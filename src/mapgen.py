@@ -0,0 +1,406 @@
+from datetime import datetime
+from enum import Enum
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+MAP_SHAPE = (55, 49)  # Map size in tiles, shared by clients and the server so they agree on the terrain
+TILE_SIZE = 16
+
+# Tile classes of a converted map
+FLOWER = 0
+WATER = 1
+GRASS = 2
+WALKABLE = (FLOWER, GRASS)
+CLASSES = (FLOWER, WATER, GRASS)
+
+# Ken Perlin's permutation and the gradients of improved noise, as used by the noise package
+PERM = np.array([
+    151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225, 140, 36, 103, 30, 69,
+    142, 8, 99, 37, 240, 21, 10, 23, 190, 6, 148, 247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219,
+    203, 117, 35, 11, 32, 57, 177, 33, 88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175,
+    74, 165, 71, 134, 139, 48, 27, 166, 77, 146, 158, 231, 83, 111, 229, 122, 60, 211, 133, 230,
+    220, 105, 92, 41, 55, 46, 245, 40, 244, 102, 143, 54, 65, 25, 63, 161, 1, 216, 80, 73, 209, 76,
+    132, 187, 208, 89, 18, 169, 200, 196, 135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173,
+    186, 3, 64, 52, 217, 226, 250, 124, 123, 5, 202, 38, 147, 118, 126, 255, 82, 85, 212, 207, 206,
+    59, 227, 47, 16, 58, 17, 182, 189, 28, 42, 223, 183, 170, 213, 119, 248, 152, 2, 44, 154, 163,
+    70, 221, 153, 101, 155, 167, 43, 172, 9, 129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232,
+    178, 185, 112, 104, 218, 246, 97, 228, 251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162,
+    241, 81, 51, 145, 235, 249, 14, 239, 107, 49, 192, 214, 31, 181, 199, 106, 157, 184, 84, 204,
+    176, 115, 121, 50, 45, 127, 4, 150, 254, 138, 236, 205, 93, 222, 114, 67, 29, 24, 72, 243, 141,
+    128, 195, 78, 66, 215, 61, 156, 180,
+] * 2, dtype=np.int64)
+GRAD3 = np.array([
+    (1, 1, 0), (-1, 1, 0), (1, -1, 0), (-1, -1, 0),
+    (1, 0, 1), (-1, 0, 1), (1, 0, -1), (-1, 0, -1),
+    (0, 1, 1), (0, -1, 1), (0, 1, -1), (0, -1, -1),
+    (1, 0, -1), (-1, 0, -1), (0, -1, 1), (0, 1, 1),
+], dtype=np.float32)
+GRAD3_X, GRAD3_Y, GRAD3_Z = (np.ascontiguousarray(component) for component in GRAD3.T)
+
+
+def pnoise3(x, y, z, repeat: int = 1024) -> np.ndarray:
+    """
+    Perlin noise at many points at once, matching noise.pnoise3 with its default arguments
+
+    Arguments are broadcast against each other. The noise package works in 32 bit floats,
+    so this does too, which keeps maps the same as they were when generated point by point.
+    """
+    x, y, z = (np.asarray(value, dtype=np.float64).astype(np.float32) for value in (x, y, z))
+    cells = []
+    for value in (x, y, z):
+        low = np.floor(np.fmod(value, np.float32(repeat))).astype(np.int64)
+        high = np.fmod(low + 1, repeat)
+        cells.append((low & 255, high & 255))
+    (i, ii), (j, jj), (k, kk) = cells
+
+    x, y, z = x - np.floor(x), y - np.floor(y), z - np.floor(z)
+    fx, fy, fz = (value * value * value * (value * (value * 6 - 15) + 10) for value in (x, y, z))
+    one = np.float32(1)
+
+    def grad(hash, gx, gy, gz):
+        gradient = hash & 15
+        return gx * GRAD3_X.take(gradient) + gy * GRAD3_Y.take(gradient) + gz * GRAD3_Z.take(gradient)
+
+    def lerp(t, a, b):
+        return a + t * (b - a)
+
+    A, B = PERM[i], PERM[ii]
+    AA, AB, BA, BB = PERM[A + j], PERM[A + jj], PERM[B + j], PERM[B + jj]
+    return lerp(
+        fz,
+        lerp(
+            fy,
+            lerp(fx, grad(PERM[AA + k], x, y, z), grad(PERM[BA + k], x - one, y, z)),
+            lerp(fx, grad(PERM[AB + k], x, y - one, z), grad(PERM[BB + k], x - one, y - one, z)),
+        ),
+        lerp(
+            fy,
+            lerp(fx, grad(PERM[AA + kk], x, y, z - one), grad(PERM[BA + kk], x - one, y, z - one)),
+            lerp(fx, grad(PERM[AB + kk], x, y - one, z - one), grad(PERM[BB + kk], x - one, y - one, z - one)),
+        ),
+    )
+
+
+def classify(worlds: np.ndarray) -> np.ndarray:
+    """
+    Turn noise maps into tile classes, for one map or a stack of them
+
+    Anything past 65% of the way from the mean to the max becomes flower, anything past
+    65% of the way from the mean to the min becomes water, and the rest is grass.
+    """
+    axes = (-2, -1)
+    mean = worlds.mean(axis=axes, keepdims=True)
+    flower_level = (worlds.max(axis=axes, keepdims=True) - mean) * 0.65 + mean
+    water_level = (worlds.min(axis=axes, keepdims=True) - mean) * 0.65 + mean
+    return np.where(worlds > flower_level, FLOWER, np.where(worlds < water_level, WATER, GRASS)).astype(np.int8)
+
+
+class WalkMask:
+    """
+    Which tiles of a map can be walked on, packed into one bit per tile
+
+    Lookups index straight into the bits, so checking a position is O(1) however big
+    the map is. Positions are in map pixels, and anywhere off the map is unwalkable.
+    """
+
+    def __init__(self, walkable: np.ndarray, tile_size: int = TILE_SIZE):
+        self.shape = walkable.shape  # columns, rows
+        self.tile_size = tile_size
+        self.bits = np.packbits(walkable.ravel())
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """Size of the map in pixels."""
+        return self.shape[0] * self.tile_size, self.shape[1] * self.tile_size
+
+    def walkable_tile(self, column: int, row: int) -> bool:
+        """Check whether a tile can be walked on."""
+        if not (0 <= column < self.shape[0] and 0 <= row < self.shape[1]):
+            return False
+        index = column * self.shape[1] + row
+        return bool(self.bits[index >> 3] >> (7 - (index & 7)) & 1)
+
+    def walkable(self, x: float, y: float) -> bool:
+        """Check whether a position can be walked on."""
+        return self.walkable_tile(int(x // self.tile_size), int(y // self.tile_size))
+
+    def walkable_many(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Check whether each of many positions can be walked on."""
+        columns = np.floor_divide(xs, self.tile_size)
+        rows = np.floor_divide(ys, self.tile_size)
+        inside = (columns >= 0) & (columns < self.shape[0]) & (rows >= 0) & (rows < self.shape[1])
+        index = np.where(inside, columns * self.shape[1] + rows, 0).astype(np.int64)
+        return inside & (self.bits[index >> 3] >> (7 - (index & 7)) & 1).astype(bool)
+
+
+def label_regions(classes: np.ndarray) -> np.ndarray:
+    """
+    Label the connected regions of tiles of the same class, numbering them from 0
+
+    Tiles connect to the four tiles beside them, wrapping around the edges like movement does.
+    """
+    return np.unique(_region_roots(classes), return_inverse=True)[1].reshape(classes.shape)
+
+
+def _region_roots(classes: np.ndarray) -> np.ndarray:
+    """
+    Label each tile with the flat index of the first tile of its region
+
+    Every tile starts labelled with its own index, then repeatedly takes the smallest label of
+    its neighbours in the same class and follows its label's label, so whole regions settle on
+    their smallest index in a few passes over the array rather than a flood fill per tile.
+    Any leading axes stack separate maps, which are labelled together.
+    """
+    maps = classes.reshape(-1, *classes.shape[-2:])
+    labels = np.arange(maps.size, dtype=np.int64).reshape(maps.shape)
+    flat = labels.reshape(-1)
+    # Which neighbours, in each direction, belong to the same region
+    links = [
+        (axis, shift, maps == np.roll(maps, shift, axis))
+        for axis in (1, 2)
+        for shift in (1, -1)
+    ]
+
+    # Maps drop out of the passes once their labels settle, so easy maps don't wait on hard ones
+    active = np.arange(len(maps))
+    while len(active):
+        current = labels[active]
+        merged = current.copy()
+        for axis, shift, same in links:
+            np.minimum(merged, np.roll(current, shift, axis), where=same[active], out=merged)
+        # Labels are always tile indices in the same region, so jumping through them is safe
+        labels[active] = merged
+        merged = flat[merged]
+        labels[active] = merged
+        active = active[(merged != current).any(axis=(1, 2))]
+    return labels.reshape(classes.shape)
+
+
+class SeedStats(NamedTuple):
+    """What the maps of a batch of seeds are made of, one row per seed."""
+
+    seeds: np.ndarray
+    fractions: np.ndarray  # Fraction of the map of each tile class, in CLASSES order
+    regions: np.ndarray  # Number of regions of each tile class
+    largest: np.ndarray  # Fraction of the map covered by the largest region of each tile class
+
+
+class RegionIndex:
+    """
+    The connected regions of a map, with their sizes, centroids and tiles to spawn on
+
+    Tiles are sorted by region once, so looking up the region of a position and picking a
+    random tile of a region are both O(1). Positions are in map pixels, tiles are
+    (column, row) pairs, and centroids are in tiles, ignoring that regions can wrap around.
+    """
+
+    def __init__(self, classes: np.ndarray, tile_size: int = TILE_SIZE):
+        self.tile_size = tile_size
+        self.labels = label_regions(classes)
+        self.shape = self.labels.shape
+
+        flat = self.labels.ravel()
+        self.sizes = np.bincount(flat)
+        self.kinds = np.zeros(len(self.sizes), classes.dtype)
+        self.kinds[flat] = classes.ravel()
+        columns, rows = np.divmod(np.arange(flat.size), self.shape[1])
+        self.centroids = np.stack([
+            np.bincount(flat, weights=columns) / self.sizes,
+            np.bincount(flat, weights=rows) / self.sizes,
+        ], axis=1)
+
+        # Tile indices grouped by region, each region's tiles starting at its offset
+        self._tiles = np.argsort(flat, kind="stable")
+        self._offsets = np.concatenate([[0], np.cumsum(self.sizes)[:-1]])
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def region_at(self, x: float, y: float) -> int:
+        """The region at a position, or -1 off the map."""
+        column, row = int(x // self.tile_size), int(y // self.tile_size)
+        if 0 <= column < self.shape[0] and 0 <= row < self.shape[1]:
+            return int(self.labels[column, row])
+        return -1
+
+    def largest(self, kinds: Optional[Tuple] = None) -> int:
+        """The biggest region, optionally only out of regions of some kinds."""
+        sizes = self.sizes if kinds is None else np.where(np.isin(self.kinds, kinds), self.sizes, 0)
+        return int(sizes.argmax())
+
+    def sample(self, region: int, count: int, random: np.random.Generator) -> np.ndarray:
+        """Random tiles of a region, as a (count, 2) array of columns and rows."""
+        picks = self._offsets[region] + random.integers(self.sizes[region], size=count)
+        return np.stack(np.divmod(self._tiles[picks], self.shape[1]), axis=1)
+
+    def spawn_points(self, count: int, random: np.random.Generator, region: Optional[int] = None) -> np.ndarray:
+        """
+        Random positions at tile centres to spawn at, as a (count, 2) array of x and y
+
+        They're in the largest walkable region unless given another, so nothing spawns
+        cut off on an island.
+        """
+        if region is None:
+            region = self.largest(WALKABLE)
+        return self.sample(region, count, random) * self.tile_size + self.tile_size // 2
+
+    def spawn_point(self, random: np.random.Generator, region: Optional[int] = None) -> Tuple[int, int]:
+        """A random position to spawn at, as with spawn_points."""
+        x, y = self.spawn_points(1, random, region)[0].tolist()
+        return x, y
+
+
+class MapGen:
+    """Generator for a map for the game to use.
+
+    It first creates a noise map.
+    It then uses this noise map to determine flower / water placement.
+    It then can export the map to a text file
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, int],
+        seed: int = None,
+        freq: int = 3,
+        amplitude: int = 10,
+        resolution: int = 50,
+    ):
+        """Initalizes all the important variables for map generation
+
+        Args:
+            shape (Tuple[int, int]): This determines the size of the map.
+            seed (int, optional): This is the seed the map is generated based on. Defaults to None.
+            freq (int, optional): This will ajust how often peaks and troughs show up. Defaults to 3.
+            amplitude (int, optional): This will ajust the severity of said peaks and troughs. Defaults to 10.
+            resolution (int, optional): This controls the "zoom" of map
+            so a higher number will make bodies larger and a lower will do the inverse. Defaults to 50.
+        """
+        self.seed = seed or self.generate_seed()
+        self.shape = shape
+        self.freq = freq
+        self.world = np.zeros(self.shape)
+        self.amplitude = amplitude
+        self.resolution = resolution
+        self._regions = None
+        self.version = 0  # Goes up whenever the map changes, for anything caching results about it
+
+    def __str__(self) -> str:
+        return "\n".join(
+            ("".join("{:.0f}".format(j) for j in i) for i in self.world)
+        )
+
+    def generate_noise(self):
+        """Generates a noise map."""
+        self.world = self.noise_batch([self.seed], self.shape, self.freq, self.amplitude, self.resolution)[0]
+
+    @staticmethod
+    def noise_batch(
+        seeds: Sequence[int],
+        shape: Tuple[int, int] = MAP_SHAPE,
+        freq: int = 3,
+        amplitude: int = 10,
+        resolution: int = 50,
+        step: int = 1,
+    ) -> np.ndarray:
+        """
+        Generate the noise maps of many seeds in one go, as a (seeds, columns, rows) array
+
+        With a step above 1, only every step-th column and row is generated, for a cheaper
+        and rougher look at each map.
+        """
+        columns = np.arange(0, shape[0], step)[None, :, None] / resolution * freq
+        rows = np.arange(0, shape[1], step)[None, None, :] / resolution * freq
+        depths = np.asarray(seeds, dtype=np.float64)[:, None, None] / resolution * freq
+        return pnoise3(columns, rows, depths).astype(np.float64) * amplitude
+
+    @classmethod
+    def survey(cls, seeds: Sequence[int], shape: Tuple[int, int] = MAP_SHAPE, step: int = 1, **options) -> SeedStats:
+        """
+        Generate and classify the maps of many seeds together, and measure what each is made of
+
+        This is for screening lots of seeds, such as for ones with plenty of water and one big
+        field of grass. Options are passed on to noise_batch. With a step above 1, stats come
+        from a rougher version of each map, which is much quicker but can miss thin features.
+        """
+        seeds = np.asarray(seeds, dtype=np.int64)
+        worlds = classify(cls.noise_batch(seeds, shape, step=step, **options))
+        tiles = worlds.shape[1] * worlds.shape[2]
+
+        roots = _region_roots(worlds)
+        is_root = roots == np.arange(roots.size).reshape(roots.shape)
+        sizes = np.bincount(roots.ravel(), minlength=roots.size).reshape(roots.shape)
+        fractions, regions, largest = [], [], []
+        for kind in CLASSES:
+            of_kind = worlds == kind
+            fractions.append(of_kind.sum(axis=(1, 2)) / tiles)
+            regions.append((is_root & of_kind).sum(axis=(1, 2)))
+            largest.append(np.where(is_root & of_kind, sizes, 0).max(axis=(1, 2)) / tiles)
+        return SeedStats(seeds, np.stack(fractions, axis=1), np.stack(regions, axis=1), np.stack(largest, axis=1))
+
+    @staticmethod
+    def _string_hashcode(s):
+        h = 0
+        for c in s:
+            h = (31 * h + ord(c)) & 0xFFFFFFFF
+        return ((h + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+    @classmethod
+    def generate_seed(cls):
+        """Generate a new random seed for use in maps."""
+        microsecond = str(datetime.now().time().microsecond)
+        return int(cls._string_hashcode(microsecond))
+
+    def convert(self):
+        """Convert to ints
+
+        0 = Flower
+        1 = Water
+        2 = Grass
+
+        Take anything past 1/2 of the way between mean and max and convert to 0
+        Take anything past 1/2 of the way between mean and min and convert to 1
+        Make the rest of the map 2
+        """
+        self.world = classify(self.world).astype(np.float64)
+        self._regions = None
+        self.version += 1
+
+    def walk_mask(self) -> WalkMask:
+        """Pack which tiles of the converted map can be walked on."""
+        return WalkMask(np.isin(self.world, WALKABLE))
+
+    def regions(self) -> RegionIndex:
+        """Label the regions of the converted map, once per map."""
+        if self._regions is None:
+            self._regions = RegionIndex(self.world.astype(np.int8))
+        return self._regions
+
+    def export(self, filename: str):
+        """Export the map to a text file."""
+        with open(filename, "w") as f:
+            f.write(str(self).replace("0", "F").replace("1", "W").replace("2", "G"))
+
+    def export_to_string(self) -> str:
+        """Export the map as a single-line string."""
+        return str(self).replace("0", "F").replace("1", "W").replace("2", "G").replace("\n", "|")
+
+    def _make_map(self):
+        """Make a new map."""
+        self.generate_noise()
+        self.convert()
+
+    def new_map(self, seed: int = None):
+        """Generate a new map."""
+        self.seed = seed or self.generate_seed()
+
+        self._make_map()
+
+
+class MapLegend(Enum):
+    """Enum for the map file's notation."""
+
+    WATER = "W"
+    GRASS = "G"
+    FLOWER = "F"
@@ -1,173 +1,132 @@
-from datetime import datetime
-from enum import Enum
 from typing import Optional, Tuple
 
-import noise
-import numpy as np
 import pygame
 
 from .character import Character
+from .mapgen import MapGen, MapLegend
+from .spatial import TileGrid
 from .sprites import ImportantSprites
 
 
-class MapGen:
-    """Generator for a map for the game to use.
-
-    It first creates a noise map.
-    It then uses this noise map to determine flower / water placement.
-    It then can export the map to a text file
-    """
-
-    def __init__(
-        self,
-        shape: Tuple[int, int],
-        seed: int = None,
-        freq: int = 3,
-        amplitude: int = 10,
-        resolution: int = 50,
-    ):
-        """Initalizes all the important variables for map generation
-
-        Args:
-            shape (Tuple[int, int]): This determines the size of the map.
-            seed (int, optional): This is the seed the map is generated based on. Defaults to None.
-            freq (int, optional): This will ajust how often peaks and troughs show up. Defaults to 3.
-            amplitude (int, optional): This will ajust the severity of said peaks and troughs. Defaults to 10.
-            resolution (int, optional): This controls the "zoom" of map
-            so a higher number will make bodies larger and a lower will do the inverse. Defaults to 50.
-        """
-        self.seed = seed or self.generate_seed()
-        self.shape = shape
-        self.freq = freq
-        self.world = np.zeros(self.shape)
-        self.amplitude = amplitude
-        self.resolution = resolution
-
-    def __str__(self) -> str:
-        return "\n".join(
-            ("".join("{:.0f}".format(j) for j in i) for i in self.world)
-        )
-
-    def generate_noise(self):
-        """Generates a noise map."""
-        for i in range(self.shape[0]):
-            for j in range(self.shape[1]):
-                n = (
-                    noise.pnoise3(
-                        i / self.resolution * self.freq,
-                        j / self.resolution * self.freq,
-                        self.seed / self.resolution * self.freq,
-                    )
-                    * self.amplitude
-                )
-
-                self.world[i][j] = n
-
-    @staticmethod
-    def _string_hashcode(s):
-        h = 0
-        for c in s:
-            h = (31 * h + ord(c)) & 0xFFFFFFFF
-        return ((h + 0x80000000) & 0xFFFFFFFF) - 0x80000000
-
-    @classmethod
-    def generate_seed(cls):
-        """Generate a new random seed for use in maps."""
-        microsecond = str(datetime.now().time().microsecond)
-        return int(cls._string_hashcode(microsecond))
-
-    def convert(self):
-        """Convert to ints
-
-        0 = Flower
-        1 = Water
-        2 = Grass
-
-        Take anything past 1/2 of the way between mean and max and convert to 0
-        Take anything past 1/2 of the way between mean and min and convert to 1
-        Make the rest of the map 2
-        """
-        flowerLevel = (
-            (self.world.max() - self.world.mean()) * 0.65
-        ) + self.world.mean()
-        waterLevel = ((self.world.min() - self.world.mean()) * 0.65) + self.world.mean()
-
-        for i in range(self.shape[0]):
-            for j in range(self.shape[1]):
-                if self.world[i][j] > flowerLevel:
-                    self.world[i][j] = 0
-                elif self.world[i][j] < waterLevel:
-                    self.world[i][j] = 1
-                else:
-                    self.world[i][j] = 2
-
-    def export(self, filename: str):
-        """Export the map to a text file."""
-        with open(filename, "w") as f:
-            f.write(str(self).replace("0", "F").replace("1", "W").replace("2", "G"))
-
-    def export_to_string(self) -> str:
-        """Export the map as a single-line string."""
-        return str(self).replace("0", "F").replace("1", "W").replace("2", "G").replace("\n", "|")
-
-    def _make_map(self):
-        """Make a new map."""
-        self.generate_noise()
-        self.convert()
-
-    def new_map(self, seed: int = None):
-        """Generate a new map."""
-        self.seed = seed or self.generate_seed()
-
-        self._make_map()
-
-
-class MapLegend(Enum):
-    """Enum for the map file's notation."""
-
-    WATER = "W"
-    GRASS = "G"
-    FLOWER = "F"
-
-
 class MapSprite:
     """Sprite for the map.
 
     It has a position and a sprite.
     It can be drawn to the screen.
+
+    The map is rendered once into a cached background surface, which is only rebuilt
+    when the map changes. Its layer is meant to be static, so the scene restores it under
+    moving sprites from the layer's composite.
+    With a camera, only the tiles in view are drawn, and scrolling reuses the cache.
     """
 
     def __init__(self, mapFileDir: Optional[str] = None, x: int = 0, y: int = 0):
+        self.dirty = True
+        self.background = None
+        self.camera = None
+        self._stale = True
+        self._rendered_view = None
+        self._tile_grid = None
+
         if mapFileDir:
             self.register_new_map(mapFileDir)
 
         self.x = x
         self.y = y
 
-    def update(self, screen: pygame.Surface, _):
-        """Draw the map out on the screen"""
-        rects = []
+    @property
+    def size(self) -> Tuple[int, int]:
+        """Size of the whole map in pixels."""
+        return 16 * len(self._map), 16 * max((len(row) for row in self._map), default=0)
+
+    @property
+    def tiles(self) -> TileGrid:
+        """The map's tiles, indexed for proximity and collision queries."""
+        if self._tile_grid is None:
+            self._tile_grid = TileGrid(self._map)
+        return self._tile_grid
+
+    def _view(self) -> pygame.Rect:
+        """The area of the map, in map pixels, that the background covers."""
+        if self.camera is None:
+            return pygame.Rect((0, 0), self.size)
+        return self.camera.visible_rect
+
+    def _origin(self) -> Tuple[int, int]:
+        """Where the background goes on screen."""
+        if self.camera is None:
+            return self.x, self.y
+        return self.camera.viewport.topleft
+
+    def _draw_tiles(self, area: pygame.Rect):
+        """Draw the tiles intersecting an area of the map onto the background."""
+        view = self._rendered_view
+        columns = range(max(0, area.left // 16), min(len(self._map), -(-area.right // 16)))
+        rows = range(max(0, area.top // 16), -(-area.bottom // 16))
+
+        self.background.fill((0, 0, 0), area.move(-view.x, -view.y))
+        self.background.blits(
+            [
+                (self._tiles[self._map[indexX][indexY]], (16 * indexX - view.x, 16 * indexY - view.y))
+                for indexX in columns
+                for indexY in rows
+                if indexY < len(self._map[indexX])
+            ],
+            doreturn=False,
+        )
 
+    def render(self) -> pygame.Surface:
+        """Draw every tile in view into the cached background surface."""
         sprites = ImportantSprites()
 
-        map_sprites = {
-            MapLegend.WATER: sprites.get_water(),
-            MapLegend.GRASS: sprites.get_grass(),
-            MapLegend.FLOWER: sprites.get_flowers(),
+        self._tiles = {
+            MapLegend.WATER.value: sprites.get_water(),
+            MapLegend.GRASS.value: sprites.get_grass(),
+            MapLegend.FLOWER.value: sprites.get_flowers(),
         }
 
-        for indexX, row in enumerate(self._map):
-            for indexY, column in enumerate(row):
-                screen.blit(
-                    map_sprites[MapLegend(column)],
-                    (16 * indexX + self.x, 16 * indexY + self.y, 16, 16),
-                )
-                rects.append(
-                    pygame.Rect(
-                        (16 * indexX + self.x, 16 * indexY + self.y, 16, 16),
-                    )
-                )
-        return rects
+        view = self._view()
+        self.background = pygame.Surface(view.size).convert()
+        self._rendered_view = view
+        self._draw_tiles(view)
+        self._stale = False
+        self.dirty = True
+        return self.background
+
+    def scroll(self, view: pygame.Rect):
+        """Move the cached background to a new view, only drawing the newly exposed tiles."""
+        old = self._rendered_view
+        dx, dy = view.x - old.x, view.y - old.y
+        if abs(dx) >= view.w or abs(dy) >= view.h:
+            self._rendered_view = view
+            self._draw_tiles(view)
+        else:
+            self.background.scroll(-dx, -dy)
+            self._rendered_view = view
+            if dx:
+                self._draw_tiles(pygame.Rect(view.right - dx if dx > 0 else view.left, view.top, abs(dx), view.h))
+            if dy:
+                self._draw_tiles(pygame.Rect(view.left, view.bottom - dy if dy > 0 else view.top, view.w, abs(dy)))
+        self.dirty = True
+
+    def update(self, screen: pygame.Surface, _):
+        """Draw the map out on the screen
+
+        The map is only drawn when it has changed or scrolled.
+        """
+        if not hasattr(self, "_map"):
+            return []
+
+        view = self._view()
+        if self._stale or self.background is None or view.size != self.background.get_size():
+            self.render()
+        elif view.topleft != self._rendered_view.topleft:
+            self.scroll(view)
+
+        if self.dirty:
+            self.dirty = False
+            return [screen.blit(self.background, self._origin())]
+        return []
 
     def get_key_color(self, key: MapLegend) -> pygame.Color:
         """Get the color of a key."""
@@ -191,10 +150,14 @@ class MapSprite:
         """Change the map being used."""
         with open(mapFileDir, "r") as f:
             self._map = list(list(i) for i in (f.read().split("\n")))
+        self._stale = True
+        self._tile_grid = None
 
     def register_from_string(self, map_data: str):
         """Change the map being used to one provided as string data."""
         self._map = list(list(i) for i in (map_data.split("|")))
+        self._stale = True
+        self._tile_grid = None
 
 
 if __name__ == "__main__":
@@ -232,6 +195,7 @@ if __name__ == "__main__":
 
     game = Game()
     game.add_sprite(0, sprite)
+    game.set_layer_static(0)
 
     def new_map(evt: pygame.event.Event):
         """Render a new map when r is pressed."""
@@ -240,16 +204,18 @@ if __name__ == "__main__":
             print(f"\n\n {mapGenerator}")
             mapGenerator.export(exportDir)
             sprite.register_new_map(exportDir)
+            game.invalidate(sprite)
 
     game.add_handler(
         new_map,
         pygame.KEYDOWN,
+        keys=(pygame.K_r,),
     )
 
     player1 = Character(spawn_position=(50, 50))
 
     game.add_sprite(1, player1)
-    game.add_handler(player1.input, pygame.KEYDOWN, pygame.KEYUP)
+    game.add_handler(player1.input, pygame.KEYDOWN, pygame.KEYUP, keys=player1.MOVEMENT_KEYS)
 
     game.start()
 
@@ -0,0 +1,138 @@
+import time
+from typing import Optional
+
+import numpy as np
+
+from .entities import EntityStore
+
+
+def wrapped_delta(start: np.ndarray, end: np.ndarray, bound: np.ndarray) -> np.ndarray:
+    """The difference from start to end, the short way around where positions wrap at bound."""
+    delta = end - start
+    wraps = np.isfinite(bound)
+    half = np.where(wraps, bound / 2, 0)
+    return np.mod(delta + half, bound, where=wraps, out=delta.copy()) - half
+
+
+class SnapshotBuffer:
+    """
+    A jitter buffer of server snapshots for remote entities, played back a little behind
+
+    Positions from the server are stamped with the server's clock. Remote entities are
+    drawn where they were delay seconds before the newest snapshot, interpolating between
+    the snapshots either side, so they move smoothly however unevenly snapshots arrive.
+    If snapshots stop coming, entities that were moving carry on for up to
+    max_extrapolation seconds, then wait.
+
+    It's a Game system, placing every buffered entity once a frame in a few array operations.
+    """
+
+    def __init__(
+        self,
+        store: EntityStore,
+        delay: float = 0.15,
+        max_extrapolation: float = 0.25,
+        size: int = 16,
+    ):
+        self.store = store
+        self.delay = delay  # Seconds behind the server to draw at, more than the time between snapshots
+        self.max_extrapolation = max_extrapolation
+        self.size = size
+        self.lag = None  # Smallest local time minus server time seen, our best guess at the clock offset
+        self.latest = -np.inf  # Newest server time heard of, from any entity
+        self._grow(store.capacity)
+
+    def _grow(self, capacity: int) -> None:
+        """Make room for rows up to a capacity, keeping what's buffered. Each row's oldest snapshot comes first."""
+        for name, shape, fill in (
+            ("times", (capacity, self.size), -np.inf),
+            ("xs", (capacity, self.size), 0.0),
+            ("ys", (capacity, self.size), 0.0),
+            ("counts", capacity, 0),
+        ):
+            array = np.full(shape, fill, np.int64 if name == "counts" else np.float64)
+            old = getattr(self, name, None)
+            if old is not None:
+                array[:len(old)] = old
+            setattr(self, name, array)
+
+    def observe(self, server_time: float, local_time: Optional[float] = None) -> None:
+        """Learn the server clock from a message stamped with server_time, received at local_time."""
+        if local_time is None:
+            local_time = time.perf_counter()
+        lag = local_time - server_time
+        if self.lag is None or lag < self.lag:
+            self.lag = lag  # The quickest message is the best measure of the offset
+        else:
+            self.lag += (lag - self.lag) * 0.01  # Slowly follow clock drift
+        self.latest = max(self.latest, server_time)
+
+    def reset(self, row: int) -> None:
+        """Forget a row's snapshots, such as when it's allocated to a new entity."""
+        if row < len(self.counts):
+            self.counts[row] = 0
+            self.times[row] = -np.inf
+
+    def add(self, row: int, server_time: float, x: float, y: float) -> None:
+        """Buffer a snapshot of where a row was at a server time."""
+        if row >= len(self.counts):
+            self._grow(self.store.capacity)
+        times = self.times[row]
+        if self.counts[row] and server_time < times[-1]:
+            return  # Older than what we have, it adds nothing
+        for values, value in ((times, server_time), (self.xs[row], x), (self.ys[row], y)):
+            values[:-1] = values[1:]
+            values[-1] = value
+        self.counts[row] = min(self.counts[row] + 1, self.size)
+
+    def render_time(self, local_time: Optional[float] = None) -> float:
+        """The server time that entities are drawn at."""
+        if local_time is None:
+            local_time = time.perf_counter()
+        return local_time - (self.lag or 0.0) - self.delay
+
+    def sample(self, render_time: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Where each buffered row is at a server time, as rows, xs and ys."""
+        rows = np.flatnonzero(self.counts)
+        if not len(rows):
+            return rows, np.zeros(0), np.zeros(0)
+
+        last = self.size - 1
+        times, xs, ys = self.times[rows], self.xs[rows], self.ys[rows]
+        first = self.size - self.counts[rows]
+        # Snapshots are in time order, so counting the ones at or before render_time finds the one before it
+        before = np.clip((times <= render_time).sum(axis=1) - 1, first, last)
+
+        # Snapshots are only sent for things that moved, so past an entity's last snapshot it
+        # stood still, unless the whole stream is late and it was moving when the stream stopped
+        last_times = times[:, last]
+        moving = (self.counts[rows] > 1) & (self.latest - last_times <= 1.5 * (last_times - times[:, last - 1]))
+        extrapolating = (before == last) & moving & (render_time > self.latest)
+        before = np.where(extrapolating, last - 1, before)
+        after = np.where(extrapolating, last, np.minimum(before + 1, last))
+
+        def pick(values, index):
+            return np.take_along_axis(values, index[:, None], axis=1)[:, 0]
+
+        t0, t1 = pick(times, before), pick(times, after)
+        span = t1 - t0
+        progress = np.divide(render_time - t0, span, out=np.zeros(len(rows)), where=span > 0)
+        extra = np.divide(self.max_extrapolation, span, out=np.zeros(len(rows)), where=span > 0)
+        progress = np.clip(progress, 0, np.where(extrapolating, 1 + extra, 1))
+
+        positions = []
+        for values, bound in ((xs, self.store.max_x[rows]), (ys, self.store.max_y[rows])):
+            start = pick(values, before)
+            positions.append(start + wrapped_delta(start, pick(values, after), bound) * progress)
+        return rows, positions[0], positions[1]
+
+    def fixed_update(self, dt: float) -> None:
+        """Snapshots come from the server, there's nothing to simulate."""
+
+    def interpolate(self, alpha: float) -> None:
+        """Place every buffered row where it was at the current render time."""
+        if self.lag is None:
+            return
+        rows, xs, ys = self.sample(self.render_time())
+        if len(rows):
+            self.store.place(rows, xs, ys)
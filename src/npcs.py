@@ -0,0 +1,88 @@
+from typing import Optional
+
+import numpy as np
+
+from .entities import EntityStore
+from .mapgen import MAP_SHAPE, TILE_SIZE, RegionIndex, WalkMask
+
+WORLD_SIZE = (TILE_SIZE * MAP_SHAPE[0], TILE_SIZE * MAP_SHAPE[1])
+
+
+def npc_id(rows: np.ndarray) -> np.ndarray:
+    """The ids NPCs go by in MoveTo messages, negative so they never clash with player ids."""
+    return -1 - rows
+
+
+class NPCs:
+    """
+    The non-player characters of a room, simulated by the server
+
+    NPC state lives in an EntityStore, so every NPC of a room wanders, moves, wraps and
+    is serialised in a handful of array operations per tick, however many there are.
+    Clients see NPCs through the same MoveTo messages as players, so they cost clients
+    no more than a remote player does.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        seed: Optional[int] = None,
+        world_size: tuple[int, int] = WORLD_SIZE,
+        speed: float = 30,
+        turn_rate: float = 0.5,
+        walk_mask: Optional[WalkMask] = None,
+        regions: Optional[RegionIndex] = None,
+    ):
+        self.store = EntityStore(capacity=max(1, count))
+        self.store.walk_mask = walk_mask
+        self.random = np.random.default_rng(None if seed is None else seed & 0xFFFFFFFF)
+        self.turn_rate = turn_rate  # Chance per second of each NPC picking a new direction
+
+        width, height = world_size
+        if regions is not None:
+            xs, ys = regions.spawn_points(count, self.random).T
+        else:
+            xs, ys = self.random.uniform(0, width, count), self.random.uniform(0, height, count)
+        self.rows = np.array([
+            self.store.allocate(
+                x=x,
+                y=y,
+                max_x=width,
+                max_y=height,
+                speed=speed,
+                dir_x=self.random.integers(-1, 2),
+                dir_y=self.random.integers(-1, 2),
+            )
+            for x, y in zip(xs, ys)
+        ], dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def step(self, dt: float) -> None:
+        """Turn some NPCs in new directions, then move them all by dt seconds."""
+        turning = self.rows[self.random.random(len(self.rows)) < self.turn_rate * dt]
+        directions = self.random.integers(-1, 2, size=(2, len(turning)))
+        self.store.dir_x[turning] = directions[0]
+        self.store.dir_y[turning] = directions[1]
+        self.store.fixed_update(dt)
+
+    def snapshot(self, full: bool = False, server_time: Optional[float] = None) -> Optional[str]:
+        """
+        A MoveTo message with the positions of the NPCs that moved in the last step
+
+        With full, it has the positions of every NPC, for players that just joined.
+        With a server time, it's stamped with it, for clients to play moves back smoothly.
+        Returns None if there's nothing to send.
+        """
+        rows = self.rows if full else self.rows[self.store.moved[self.rows]]
+        if not len(rows):
+            return None
+
+        ids = npc_id(rows).tolist()
+        xs = self.store.x[rows].astype(np.int64).tolist()
+        ys = self.store.y[rows].astype(np.int64).tolist()
+        moves = "|".join(f"{i},{x},{y}" for i, x, y in zip(ids, xs, ys))
+        if server_time is not None:
+            return f"MoveTo: @{server_time:.3f}|{moves}"
+        return "MoveTo: " + moves
@@ -0,0 +1,179 @@
+import heapq
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from .entities import EntityStore
+from .mapgen import TILE_SIZE, WALKABLE, MapGen, label_regions
+
+# Steps to the four neighbours of a tile, in (column, row)
+STEPS = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)], dtype=np.int64)
+UNREACHABLE = -1
+
+
+class FlowField:
+    """
+    Distances to a target tile from every tile of a map, and the step towards it from each
+
+    One field steers any number of agents heading to the same target, each looking up the
+    direction of the tile it's on. Tiles that can't reach the target have no direction.
+    """
+
+    def __init__(self, distances: np.ndarray, directions: np.ndarray, tile_size: int):
+        self.distances = distances  # Steps to the target, or UNREACHABLE, indexed [column, row]
+        self.directions = directions  # (dx, dy) step towards the target, indexed [column, row]
+        self.tile_size = tile_size
+
+    def _tiles(self, xs: np.ndarray, ys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        columns, rows = self.distances.shape
+        return (
+            np.floor_divide(xs, self.tile_size).astype(np.int64) % columns,
+            np.floor_divide(ys, self.tile_size).astype(np.int64) % rows,
+        )
+
+    def distance_at(self, x: float, y: float) -> int:
+        """Steps to the target from a position, or UNREACHABLE."""
+        column, row = self._tiles(np.array(x), np.array(y))
+        return int(self.distances[column, row])
+
+    def direction_at(self, x: float, y: float) -> tuple[int, int]:
+        """The direction to head from a position, (0, 0) at the target or if it can't be reached."""
+        column, row = self._tiles(np.array(x), np.array(y))
+        dx, dy = self.directions[column, row].tolist()
+        return dx, dy
+
+    def directions_many(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """The directions to head from many positions, as a (count, 2) array."""
+        return self.directions[self._tiles(xs, ys)]
+
+    def steer(self, store: EntityStore, rows: np.ndarray) -> None:
+        """Point some entities of a store towards the target."""
+        directions = self.directions_many(store.x[rows], store.y[rows])
+        store.dir_x[rows] = directions[:, 0]
+        store.dir_y[rows] = directions[:, 1]
+
+
+class Pathfinder:
+    """
+    Paths over the walkable tiles of a map, A* for single paths and flow fields for crowds
+
+    Paths move between the four tiles beside each other, wrapping around the edges like
+    movement does. Flow fields are cached per target, and the cache is dropped whenever the
+    map's version changes, so hundreds of agents chasing one target cost one field between
+    them. Positions are in map pixels.
+    """
+
+    def __init__(self, map_gen: MapGen, tile_size: int = TILE_SIZE, max_fields: int = 64):
+        self.map_gen = map_gen
+        self.tile_size = tile_size
+        self.max_fields = max_fields
+        self.version = None
+        self._fields: OrderedDict[tuple[int, int, int], FlowField] = OrderedDict()  # Least recently used first
+        self._refresh()
+
+    def _refresh(self) -> None:
+        """Pick up changes to the map, forgetting everything worked out about the old one."""
+        if self.version == self.map_gen.version:
+            return
+        self.version = self.map_gen.version
+        self.walkable = np.isin(self.map_gen.world, WALKABLE)
+        self.shape = self.walkable.shape
+        # Tiles that can't reach each other are in different regions, so searches between them can stop early
+        self.regions = label_regions(self.walkable)
+        self._fields.clear()
+
+    def tile(self, x: float, y: float) -> tuple[int, int]:
+        """The (column, row) of the tile at a position, wrapped onto the map."""
+        return int(x // self.tile_size) % self.shape[0], int(y // self.tile_size) % self.shape[1]
+
+    def reachable(self, start: tuple[int, int], goal: tuple[int, int]) -> bool:
+        """Check whether there's a path between two tiles."""
+        self._refresh()
+        return bool(
+            self.walkable[start] and self.walkable[goal] and self.regions[start] == self.regions[goal]
+        )
+
+    def find_path(self, start: tuple[float, float], goal: tuple[float, float]) -> Optional[np.ndarray]:
+        """
+        The shortest path between two positions with A*, or None if there isn't one
+
+        The path is the centres of the tiles along it, as a (count, 2) array of x and y,
+        from the start's tile to the goal's.
+        """
+        start, goal = self.tile(*start), self.tile(*goal)
+        if not self.reachable(start, goal):
+            return None
+
+        columns, rows = self.shape
+        walkable = self.walkable
+
+        def estimate(tile):
+            # Manhattan distance, the short way around the wrapping edges
+            dx, dy = abs(tile[0] - goal[0]), abs(tile[1] - goal[1])
+            return min(dx, columns - dx) + min(dy, rows - dy)
+
+        came_from = {start: None}
+        cost = {start: 0}
+        frontier = [(estimate(start), 0, start)]
+        while frontier:
+            _, steps, tile = heapq.heappop(frontier)
+            if tile == goal:
+                break
+            if steps > cost[tile]:
+                continue  # A shorter way here was already handled
+            for dx, dy in STEPS.tolist():
+                neighbour = ((tile[0] + dx) % columns, (tile[1] + dy) % rows)
+                if walkable[neighbour] and steps + 1 < cost.get(neighbour, steps + 2):
+                    cost[neighbour] = steps + 1
+                    came_from[neighbour] = tile
+                    heapq.heappush(frontier, (steps + 1 + estimate(neighbour), steps + 1, neighbour))
+
+        path = []
+        tile = goal
+        while tile is not None:
+            path.append(tile)
+            tile = came_from[tile]
+        return np.array(path[::-1], dtype=np.int64) * self.tile_size + self.tile_size // 2
+
+    def flow_field(self, target: tuple[float, float]) -> FlowField:
+        """The flow field towards a position, worked out once per target and map."""
+        self._refresh()
+        goal = self.tile(*target)
+        key = (self.version, *goal)
+        field = self._fields.get(key, None)
+        if field is not None:
+            self._fields.move_to_end(key)
+            return field
+
+        field = self._make_field(goal)
+        self._fields[key] = field
+        if len(self._fields) > self.max_fields:
+            self._fields.popitem(last=False)
+        return field
+
+    def _make_field(self, goal: tuple[int, int]) -> FlowField:
+        """Breadth first search out from the goal, a whole ring of tiles per pass."""
+        distances = np.full(self.shape, UNREACHABLE, np.int32)
+        frontier = np.zeros(self.shape, bool)
+        if self.walkable[goal]:
+            frontier[goal] = True
+            distances[goal] = 0
+
+        steps = 0
+        while frontier.any():
+            steps += 1
+            reached = np.zeros(self.shape, bool)
+            for dx, dy in STEPS.tolist():
+                reached |= np.roll(frontier, (dx, dy), axis=(0, 1))
+            frontier = reached & self.walkable & (distances == UNREACHABLE)
+            distances[frontier] = steps
+
+        # Each tile heads to whichever neighbour is closest to the goal
+        big = np.iinfo(np.int32).max
+        known = np.where(distances == UNREACHABLE, big, distances)
+        neighbours = np.stack([np.roll(known, (-dx, -dy), axis=(0, 1)) for dx, dy in STEPS.tolist()])
+        best = neighbours.argmin(axis=0)
+        directions = STEPS[best].astype(np.int8)
+        directions[(known == big) | (distances == 0)] = 0
+        return FlowField(distances, directions, self.tile_size)
@@ -0,0 +1,167 @@
+import json
+import time
+from collections import defaultdict, deque
+from typing import Optional
+
+import pygame
+
+
+def stage_name(func: callable, prefix: str) -> str:
+    """A readable, stable name for a handler or sprite method."""
+    owner = getattr(func, "__self__", None)
+    if owner is not None and not isinstance(owner, type):
+        return f"{prefix} {type(owner).__name__}.{func.__name__}"
+    return f"{prefix} {getattr(func, '__qualname__', repr(func))}"
+
+
+class FrameProfiler:
+    """
+    Measures where each frame's time goes
+
+    Stage times (per event handler, per sprite update, the display update) are summed
+    per frame and kept for a rolling window. While tracing, every measurement is also
+    kept as a Chrome trace event, which can be dumped to JSON and opened in
+    chrome://tracing or Perfetto.
+    """
+
+    def __init__(self, window: int = 300, max_trace_events: int = 200_000):
+        self.window = window
+        self.frame_times = deque(maxlen=window)
+        self.stage_times: dict[str, deque] = {}
+        self.trace_events = deque(maxlen=max_trace_events)
+        self.tracing = False
+        self.overlay_visible = False
+
+        self._frame = defaultdict(float)
+        self._frame_start = 0.0
+        self._origin = time.perf_counter()
+        self._overlay = None
+        self._overlay_time = 0.0
+        self._font = None
+
+    def begin_frame(self) -> None:
+        """Start timing a new frame."""
+        self._frame.clear()
+        self._frame_start = time.perf_counter()
+
+    def measure(self, name: str, func: callable, *args):
+        """Call a function, attributing its run time to a named stage of the frame."""
+        start = time.perf_counter()
+        result = func(*args)
+        self.record(name, start, time.perf_counter())
+        return result
+
+    def record(self, name: str, start: float, end: float) -> None:
+        """Attribute a span of time to a named stage of the frame."""
+        self._frame[name] += end - start
+        if self.tracing:
+            self._trace(name, start, end)
+
+    def end_frame(self) -> None:
+        """Finish timing the frame, and add it to the rolling window."""
+        end = time.perf_counter()
+        self.frame_times.append(end - self._frame_start)
+        for name in self._frame.keys() - self.stage_times.keys():
+            self.stage_times[name] = deque(maxlen=self.window)
+        # Stages that didn't run this frame still count, so means are per frame
+        for name, times in self.stage_times.items():
+            times.append(self._frame.get(name, 0.0))
+        if self.tracing:
+            self._trace("frame", self._frame_start, end)
+
+    def _trace(self, name: str, start: float, end: float) -> None:
+        self.trace_events.append({
+            "name": name,
+            "cat": name.split(" ", 1)[0],
+            "ph": "X",
+            "ts": (start - self._origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": 0,
+            "tid": 0,
+        })
+
+    def percentiles(self, *quantiles: float) -> list[float]:
+        """Frame times at the given quantiles (0-1) of the window, in seconds."""
+        times = sorted(self.frame_times)
+        if not times:
+            return [0.0 for _ in quantiles]
+        return [times[min(len(times) - 1, int(quantile * len(times)))] for quantile in quantiles]
+
+    def top_offenders(self, count: int = 5) -> list[tuple[str, float]]:
+        """The stages with the highest mean time per frame over the window."""
+        means = [(name, sum(times) / len(times)) for name, times in self.stage_times.items() if times]
+        means.sort(key=lambda mean: mean[1], reverse=True)
+        return means[:count]
+
+    def toggle_tracing(self, path: Optional[str] = None) -> Optional[str]:
+        """Start capturing trace events, or stop and dump them, returning the file written."""
+        if not self.tracing:
+            self.trace_events.clear()
+            self.tracing = True
+            return None
+
+        self.tracing = False
+        path = path or time.strftime("trace-%Y%m%d-%H%M%S.json")
+        self.dump_trace(path)
+        return path
+
+    def dump_trace(self, path: str) -> None:
+        """Write the captured trace events as a Chrome trace-event JSON file."""
+        with open(path, "w") as f:
+            json.dump({"traceEvents": list(self.trace_events), "displayTimeUnit": "ms"}, f)
+
+    def draw_overlay(self, screen: pygame.Surface, refresh: float = 0.25) -> Optional[pygame.Rect]:
+        """Draw frame time percentiles and the top offenders, refreshing the text a few times a second."""
+        now = time.perf_counter()
+        if self._overlay is None or now - self._overlay_time > refresh:
+            self._overlay_time = now
+            self._overlay = self._render_overlay()
+
+        return screen.blit(self._overlay, (10, screen.get_height() - self._overlay.get_height() - 10))
+
+    def _render_overlay(self) -> pygame.Surface:
+        if self._font is None:
+            self._font = pygame.font.Font(None, 18)
+
+        p50, p95, p99 = (1000 * value for value in self.percentiles(0.5, 0.95, 0.99))
+        lines = [f"frame ms  p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f}"]
+        lines += [f"{1000 * mean:7.3f} ms  {name}" for name, mean in self.top_offenders()]
+        if self.tracing:
+            lines.append(f"tracing... {len(self.trace_events)} events")
+
+        rendered = [self._font.render(line, True, (255, 255, 255)) for line in lines]
+        width = max(line.get_width() for line in rendered) + 10
+        height = sum(line.get_height() for line in rendered) + 10
+        if self._overlay is not None:
+            # Never shrink, so the previous overlay is always fully covered
+            width = max(width, self._overlay.get_width())
+            height = max(height, self._overlay.get_height())
+
+        surface = pygame.Surface((width, height))
+        y = 5
+        for line in rendered:
+            surface.blit(line, (5, y))
+            y += line.get_height()
+        return surface
+
+
+class StartupProfiler:
+    """Times each phase of starting up, such as imports, creating the window and connecting."""
+
+    def __init__(self, start: Optional[float] = None):
+        self.start = start if start is not None else time.perf_counter()
+        self.phases: list[tuple[str, float]] = []
+        self._last = self.start
+
+    def lap(self, name: str) -> None:
+        """End a phase, which began when the previous one ended."""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def report(self) -> None:
+        """Print how long each phase took, and the total."""
+        print("startup ms by phase:")
+        for name, duration in self.phases:
+            print(f"  {1000 * duration:8.1f}  {name}")
+        print(f"  {1000 * (self._last - self.start):8.1f}  total")
@@ -0,0 +1,180 @@
+import bisect
+from typing import Optional
+
+import pygame
+
+from .profiler import FrameProfiler
+
+
+class Layer:
+    """
+    A group of sprites drawn at the same depth
+
+    Dynamic layers have all their sprites updated every frame. Static layers are
+    rendered once into a cached composite surface, and only re-rendered when invalidated.
+    """
+
+    def __init__(self, depth: int, static: bool = False):
+        self.depth = depth
+        self.static = static
+        self.sprites = {}  # Insertion ordered, with O(1) add and remove
+        self.surface = None
+        self.bounds = pygame.Rect(0, 0, 0, 0)
+        self.dirty = True
+        self._ordered = ()
+
+    def add(self, sprite: object) -> None:
+        """Add a sprite to the layer."""
+        self.sprites[sprite] = None
+        self._ordered = None
+        self.dirty = True
+
+    def remove(self, sprite: object) -> None:
+        """Remove a sprite from the layer."""
+        del self.sprites[sprite]
+        self._ordered = None
+        self.dirty = True
+
+    def __iter__(self):
+        # Iterate over a snapshot, so sprites added from the network thread can't break a frame
+        if self._ordered is None:
+            self._ordered = tuple(self.sprites)
+        return iter(self._ordered)
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def render(self, size: tuple[int, int], dt: float) -> pygame.Rect:
+        """Redraw every sprite of a static layer into its composite surface."""
+        if self.surface is None or self.surface.get_size() != size:
+            self.surface = pygame.Surface(size, pygame.SRCALPHA)
+        self.surface.fill((0, 0, 0, 0))
+
+        rects = []
+        for sprite in self:
+            # Sprites with their own cache must redraw fully onto the fresh composite
+            if hasattr(sprite, "dirty"):
+                sprite.dirty = True
+            rects.extend(sprite.update(self.surface, dt))
+
+        self.bounds = rects[0].unionall(rects[1:]) if rects else pygame.Rect(0, 0, 0, 0)
+        self.dirty = False
+        return self.bounds
+
+
+class Scene:
+    """
+    A retained set of sprites, ordered by layer
+
+    Sprites are indexed for O(1) removal, and layers are kept sorted as they're created.
+    Regions that dynamic sprites drew over last frame are restored from the static composites,
+    so static layers cost nothing per frame unless something moves over them.
+    """
+
+    def __init__(self, size: tuple[int, int]):
+        self.size = size
+        self.layers: dict[int, Layer] = {}
+        self._depths = []
+        self._ordered = ()
+        self._index: dict[object, Layer] = {}
+        self._simulated = {}
+        self._simulated_ordered = ()
+        self._previous = []
+
+    def layer(self, depth: int) -> Layer:
+        """Get the layer at a depth, creating it if needed."""
+        layer = self.layers.get(depth)
+        if layer is None:
+            layer = self.layers[depth] = Layer(depth)
+            bisect.insort(self._depths, depth)
+            self._ordered = None
+        return layer
+
+    def set_static(self, depth: int, static: bool = True) -> None:
+        """Mark a layer as static (cached) or dynamic (updated every frame)."""
+        layer = self.layer(depth)
+        layer.static = static
+        layer.dirty = True
+
+    def add(self, depth: int, sprite: object) -> None:
+        """Add a sprite to a layer."""
+        layer = self.layer(depth)
+        layer.add(sprite)
+        self._index[sprite] = layer
+        if hasattr(sprite, "fixed_update"):
+            self._simulated[sprite] = None
+            self._simulated_ordered = None
+
+    def remove(self, sprite: object) -> None:
+        """Remove a sprite from whichever layer it's in."""
+        self._index.pop(sprite).remove(sprite)
+        if sprite in self._simulated:
+            del self._simulated[sprite]
+            self._simulated_ordered = None
+
+    def invalidate(self, sprite: object) -> None:
+        """Have the layer holding a sprite re-rendered next frame."""
+        self._index[sprite].dirty = True
+
+    def invalidate_static(self) -> None:
+        """Have every static layer re-rendered next frame."""
+        for layer in self.layers.values():
+            if layer.static:
+                layer.dirty = True
+
+    def fixed_update(self, dt: float) -> None:
+        """Advance every simulated sprite (those with a fixed_update method) by one step."""
+        if self._simulated_ordered is None:
+            self._simulated_ordered = tuple(self._simulated)
+        for sprite in self._simulated_ordered:
+            sprite.fixed_update(dt)
+
+    def active(self) -> bool:
+        """Whether any dynamic sprite reports that it's animating."""
+        return any(
+            getattr(sprite, "active", False) for layer in self._layers() if not layer.static for sprite in layer
+        )
+
+    def __contains__(self, sprite: object) -> bool:
+        return sprite in self._index
+
+    def __iter__(self):
+        for layer in self._layers():
+            yield from layer
+
+    def _layers(self) -> tuple[Layer]:
+        if self._ordered is None:
+            self._ordered = tuple(self.layers[depth] for depth in self._depths)
+        return self._ordered
+
+    def update(self, screen: pygame.Surface, dt: float, profiler: Optional[FrameProfiler] = None) -> list[pygame.Rect]:
+        """Update and draw every layer in order, returning the changed rects."""
+        changed = []
+        drawn = []
+        for layer in self._layers():
+            if not layer.static:
+                for sprite in layer:
+                    if profiler is None:
+                        drawn.extend(sprite.update(screen, dt))
+                    else:
+                        drawn.extend(profiler.measure(f"update {type(sprite).__name__}", sprite.update, screen, dt))
+                continue
+
+            if layer.dirty:
+                if profiler is None:
+                    bounds = layer.render(self.size, dt)
+                else:
+                    bounds = profiler.measure(f"render layer {layer.depth}", layer.render, self.size, dt)
+                changed.append(screen.blit(layer.surface, bounds, bounds))
+                continue
+
+            # Restore what dynamic sprites covered last frame, and keep this layer over
+            # whatever has been drawn beneath it so far this frame
+            for rect in (*self._previous, *drawn):
+                area = rect.clip(layer.bounds)
+                if area:
+                    changed.append(screen.blit(layer.surface, area, area))
+
+        self._previous = drawn
+        changed.extend(drawn)
+        return changed
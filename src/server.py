@@ -1,8 +1,14 @@
 import asyncio
+import secrets
 import traceback
+from typing import Optional
 
 import websockets
 
+from .datagrams import DATAGRAM_PORT, DatagramChannel
+from .mapgen import MAP_SHAPE, MapGen
+from .npcs import NPCs
+
 
 class GameRoom:
     """Class for maintaining game rooms"""
@@ -12,6 +18,16 @@ class GameRoom:
         self.room_players = {}      # (key-> player_id: int, value-> player_name: str)
         self._room_size_ = 0
         self.max_room_size = max_size
+        self.npcs = None            # Spawned once the room's game starts
+        self.send_all_npcs = False  # Whether the next tick should send every NPC, such as for a new player
+        self.walk_mask = None       # Terrain of the room's map, once its game starts
+        self.regions = None         # Regions of the room's map, to spawn NPCs in
+        self.positions = {}         # (key-> player_id: int, value-> last accepted (x, y))
+        self.lockstep = False       # Whether players' moves are simulated by every client from relayed inputs
+        self.lockstep_seed = None   # World seed the room's lockstep game started with
+        self.turn = 0               # Number of the lockstep turn being collected
+        self.turn_entries = []      # Inputs, joins, leaves and map changes of the turn being collected
+        self.turn_log = None        # Turn messages that had entries, once the lockstep game starts
 
     @property
     def room_size(self):
@@ -39,6 +55,7 @@ class GameRoom:
             try:
                 self.room_players[player_id] = f'Player {player_id}'    # just assign string to the player_id
                 self.room_size += 1
+                self.add_turn_entry(f"+{player_id}")
                 print(f'Player {player_id} added to room {self.rid}')
                 return f"You're in room {self.rid}"
 
@@ -54,7 +71,9 @@ class GameRoom:
         if rid is not None:
             try:
                 self.room_players.pop(player_id)
+                self.positions.pop(player_id, None)
                 self.room_size -= 1
+                self.add_turn_entry(f"-{player_id}")
                 return "Bye bye"
 
             except Exception as e_mess:
@@ -63,6 +82,60 @@ class GameRoom:
         else:
             return "Player not found"
 
+    def start_lockstep(self, seed: str):
+        """Start collecting turns, with every player in the room joining in the first, if the room is in lockstep."""
+        if not self.lockstep:
+            return
+        if self.turn_log is not None:
+            self.add_turn_entry(f"={seed}")  # Restarted, which changes the map at a turn like a seed change
+            return
+        self.lockstep_seed = seed
+        self.turn_log = []
+        self.turn_entries = [f"+{player_id}" for player_id in self.room_players]
+
+    def add_turn_entry(self, entry: str):
+        """Add an entry to the turn being collected, once the room's lockstep game has started."""
+        if self.turn_log is not None:
+            self.turn_entries.append(entry)
+
+    def close_turn(self) -> str:
+        """Finish the turn being collected, returning the Turn message to send every player."""
+        message = f"Turn: {self.turn}" + "".join("|" + entry for entry in self.turn_entries)
+        if self.turn_entries:
+            self.turn_log.append(message)   # Players who join later play it through to catch up
+        self.turn_entries = []
+        self.turn += 1
+        return message
+
+    def lockstep_history(self, turn_rate: float) -> str:
+        """
+        The Lockstep message, telling a player how to play the room's turns
+
+        Its first line is the last finished turn, the turn rate and the starting seed, and each
+        line after is a finished turn that had entries. Turns left out had nothing in them.
+        """
+        header = f"Lockstep: {self.turn - 1},{turn_rate},{self.lockstep_seed}"
+        return "\n".join([header, *self.turn_log])
+
+    def validate_move(self, player_id: int, x: int, y: int) -> tuple[int, int]:
+        """
+        Check a player's move against the room's terrain, returning where they end up
+
+        Moves are clamped to the map, and moves onto unwalkable tiles are refused,
+        unless the player is already stuck on one.
+        """
+        if self.walk_mask is None:
+            return x, y
+
+        width, height = self.walk_mask.size
+        x = min(max(x, 0), width - 1)
+        y = min(max(y, 0), height - 1)
+        previous = self.positions.get(player_id, None)
+        if self.walk_mask.walkable(x, y) or previous is None or not self.walk_mask.walkable(*previous):
+            self.positions[player_id] = (x, y)
+            return x, y
+        return previous
+
     def __str__(self):
         return f'Room {self.rid} | Current Size - {self.room_size}'
 
@@ -78,6 +151,16 @@ class GameManager:
         self.player_count = 0
         self.room_count = 0     # active room count
         self.room_seeds = {}
+        self.npcs_per_room = 20
+        self.tick_rate = 10     # NPC simulation ticks per second
+        self.keyframe_interval = 2.0    # seconds between sending every NPC, in case a player missed some
+        self.turn_rate = 20     # Lockstep turns per second
+        self.datagram_port = DATAGRAM_PORT
+        self.datagrams = None           # UDP endpoint for movement, if it could be opened
+        self.datagram_tokens = {}       # (key-> token given over the websocket: str, value-> player_id: int)
+        self.datagram_addresses = {}    # (key-> player_id: int, value-> address their datagrams come from)
+        self.move_seqs = {}             # (key-> player_id: int, value-> latest move sequence number applied)
+        self.tasks = set()              # Running background tasks, which the event loop only weakly references
 
     def create_room(self, pid: int):
         """Create room"""
@@ -122,6 +205,7 @@ class GameManager:
 
         else:
             room.add_player_to_room(pid)
+            room.send_all_npcs = True
             _, ws = self.players[pid]
             self.players[pid] = (rid, ws)
             message = f'Player {pid} joined room {rid}'
@@ -145,21 +229,250 @@ class GameManager:
         else:
             await self.broadcast_messages(rid, message)
 
-    async def broadcast_messages(self, rid: int, message: str):
-        """Broadcast messages to all players in room"""
+    async def broadcast_messages(self, rid: int, message: str, skip: Optional[int] = None, movement: bool = False):
+        """
+        Broadcast messages to all players in room, except the one to skip if any
+
+        Movement goes over the datagram channel of players that have one.
+        """
         room = self.rooms.get(rid, None)
         # if room does not exist, room is None
 
         if room is not None:
-            all_players = room.room_players.keys()
+            # Players can leave while we wait on a send
+            all_players = list(room.room_players.keys())
             for player_id in all_players:
-                _, comm_socket = self.players[player_id]
-                await comm_socket.send(message)
+                if player_id == skip:
+                    continue
+                if movement:
+                    await self.send_movement(player_id, message)
+                else:
+                    _, comm_socket = self.players[player_id]
+                    await comm_socket.send(message)
 
         else:
             print(f'Server message: Room {rid} not found')
             return f'Room {rid} not found'
 
+    def set_room_seed(self, rid: int, seed: str):
+        """Record a room's world seed, and generate the terrain that moves are checked against."""
+        self.room_seeds[rid] = seed
+        room = self.rooms.get(rid, None)
+        if room is None:
+            return
+
+        try:
+            mapGenerator = MapGen(MAP_SHAPE, seed=int(seed))
+        except ValueError:
+            print(f'Server message: Bad seed {seed} for room {rid}, not checking moves')
+            room.walk_mask = room.regions = None
+        else:
+            mapGenerator.generate_noise()
+            mapGenerator.convert()
+            room.walk_mask = mapGenerator.walk_mask()
+            room.regions = mapGenerator.regions()
+        if room.npcs is not None:
+            room.npcs.store.walk_mask = room.walk_mask
+
+    async def move_player(self, websocket, target: str):
+        """
+        Pass a player's move on to their room, or correct the player if the move isn't allowed
+
+        Moves can end with a sequence number, which is acknowledged with where the player
+        ended up, so their client can reconcile its prediction.
+        """
+        try:
+            pid, x, y, *seq = (int(value) for value in target.split(","))
+            if len(seq) > 1:
+                raise ValueError(target)
+        except ValueError:
+            print("Bad move:", target)
+            return
+
+        _rid, ws = self.players.get(pid, (None, None))
+        if ws is not websocket:
+            return  # Players can only move themselves
+        await self.apply_move(pid, x, y, *seq)
+
+    async def apply_move(self, pid: int, x: int, y: int, seq: Optional[int] = None):
+        """Move a player inside their room, unless a later move of theirs has already been applied."""
+        rid, websocket = self.players.get(pid, (None, None))
+        if rid is None or self.rooms[rid].lockstep:
+            return  # Players of lockstep rooms are moved by their inputs, not positions
+        if seq is not None:
+            if seq <= self.move_seqs.get(pid, 0):
+                return  # Overtaken by a later move, such as a datagram arriving out of order
+            self.move_seqs[pid] = seq
+
+        room = self.rooms[rid]
+        previous = room.positions.get(pid, None)
+        position = room.validate_move(pid, x, y)
+        if seq is not None:
+            await self.send_movement(pid, f"Ack: {seq},{position[0]},{position[1]}")
+        elif position != (x, y):
+            await websocket.send(f"Correct: {position[0]},{position[1]}")
+        if position != previous:
+            now = asyncio.get_running_loop().time()
+            message = f"MoveTo: @{now:.3f}|{pid},{position[0]},{position[1]}"
+            await self.broadcast_messages(rid, message, skip=pid, movement=True)
+
+    def run_in_background(self, coroutine):
+        """Run a coroutine as a task, kept until it's done, printing anything it raises."""
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.task_done)
+
+    def task_done(self, task: asyncio.Task):
+        """Forget a finished background task, after printing its error if it failed."""
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            traceback.print_exception(task.exception())
+
+    def offer_datagrams(self, websocket, pid) -> str:
+        """
+        Give a player a token for sending their movement over the datagram channel
+
+        Datagrams starting with the token are taken as theirs, wherever they come from.
+        """
+        if self.datagrams is None or pid is None or self.players.get(int(pid), (None, None))[1] is not websocket:
+            return "Datagram: none"
+        pid = int(pid)
+        token = secrets.token_hex(16)
+        self.datagram_tokens[token] = pid
+        return f"Datagram: {self.datagram_port},{token}"
+
+    def datagram_received(self, message: str, address: tuple):
+        """
+        Handle a datagram from a player
+
+        "Hello token" opens their channel, and is answered so they know datagrams get
+        through both ways. "Move token,seq,x,y" is a move, like a MoveTo message.
+        """
+        kind, _, body = message.partition(" ")
+        token, _, body = body.partition(",")
+        pid = self.datagram_tokens.get(token, None)
+        if pid is None or pid not in self.players:
+            return
+
+        self.datagram_addresses[pid] = address   # Follow the player if their address changes
+        if kind == "Hello":
+            self.datagrams.send("Welcome", address)
+        elif kind == "Move":
+            try:
+                seq, x, y = (int(value) for value in body.split(","))
+            except ValueError:
+                print("Bad move datagram:", message)
+                return
+            self.run_in_background(self.apply_move(pid, x, y, seq))
+
+    async def send_movement(self, pid: int, message: str):
+        """Send movement to a player, by datagram if they have a channel, as only the latest matters."""
+        address = self.datagram_addresses.get(pid, None)
+        if address is not None and self.datagrams.send(message, address):
+            return
+        _, websocket = self.players[pid]
+        await websocket.send(message)
+
+    def set_lockstep(self, rid: int):
+        """Make a room's game simulate players in lockstep, before it starts."""
+        room = self.rooms.get(rid, None)
+        if room is None:
+            return f'Room {rid} does not exist'
+        elif rid in self.room_seeds:
+            return f'Room {rid} has already started'
+        room.lockstep = True
+        print(f'Server message: Room {rid} set to lockstep')
+        return f'Room {rid} will play in lockstep'
+
+    def queue_input(self, websocket, target: str):
+        """Add a player's key press or release to the turn their lockstep room is collecting."""
+        try:
+            pid, key, down = (int(value) for value in target.split(","))
+            if down not in (0, 1):
+                raise ValueError(target)
+        except ValueError:
+            print("Bad input:", target)
+            return
+
+        rid, ws = self.players.get(pid, (None, None))
+        if ws is not websocket or rid is None:
+            return  # Players can only move themselves, inside a room
+        self.rooms[rid].add_turn_entry(f"{pid},{key},{down}")
+
+    async def start_lockstep(self, rid: int, seed: str):
+        """Start a lockstep room's turns, if they aren't already, telling its players to play them."""
+        room = self.rooms.get(rid, None)
+        if room is None or not room.lockstep:
+            return
+        started = room.turn_log is not None
+        room.start_lockstep(seed)
+        if not started:
+            await self.broadcast_messages(rid, room.lockstep_history(self.turn_rate))
+            self.run_in_background(self.lockstep_tick(rid, room))
+
+    async def lockstep_tick(self, rid: int, room: GameRoom):
+        """Finish a lockstep room's turns at the turn rate, sending each to its players, until the room closes."""
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.turn_rate
+        next_turn = loop.time() + interval
+
+        while self.rooms.get(rid, None) is room:
+            await asyncio.sleep(max(0.0, next_turn - loop.time()))
+            next_turn += interval
+            if self.rooms.get(rid, None) is not room:
+                break
+            try:
+                await self.broadcast_messages(rid, room.close_turn())
+            except websockets.ConnectionClosed:
+                pass  # The player is removed by their own connection handler
+            except Exception as _e_mess:  # noqa: F841
+                print(traceback.format_exc())
+        print(f'Server message: Room {rid} stopped taking turns')
+
+    def start_npcs(self, rid: int, seed: str):
+        """Spawn a room's NPCs and start simulating them, if they aren't already."""
+        room = self.rooms.get(rid, None)
+        if room is None or room.npcs is not None:
+            return
+
+        try:
+            seed = int(seed)
+        except ValueError:
+            seed = None
+        room.npcs = NPCs(self.npcs_per_room, seed, walk_mask=room.walk_mask, regions=room.regions)
+        room.send_all_npcs = True
+        self.run_in_background(self.room_tick(rid, room))
+
+    async def room_tick(self, rid: int, room: GameRoom):
+        """Step a room's NPCs at the tick rate, sending their moves to its players, until the room closes."""
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.tick_rate
+        keyframe_ticks = max(1, round(self.keyframe_interval * self.tick_rate))
+        next_tick = loop.time()
+        tick = 0
+
+        while self.rooms.get(rid, None) is room:
+            try:
+                room.npcs.step(interval)
+                full = room.send_all_npcs or tick % keyframe_ticks == 0
+                room.send_all_npcs = False
+                message = room.npcs.snapshot(full, loop.time())
+                if message is not None:
+                    await self.broadcast_messages(rid, message, movement=True)
+                if full and room.positions and not room.lockstep:
+                    # Players who stopped send nothing more, so this makes up for a lost datagram
+                    moves = "|".join(f"{pid},{x},{y}" for pid, (x, y) in room.positions.items())
+                    await self.broadcast_messages(rid, f"MoveTo: @{loop.time():.3f}|{moves}", movement=True)
+            except websockets.ConnectionClosed:
+                pass  # The player is removed by their own connection handler
+            except Exception as _e_mess:  # noqa: F841
+                print(traceback.format_exc())
+
+            tick += 1
+            next_tick += interval
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+        print(f'Server message: Room {rid} stopped ticking')
+
     async def leave_room(self, pid: int):
         """Leave room"""
         rid, _ws = self.players.get(pid, [None, None])
@@ -200,6 +513,11 @@ class GameManager:
         """Remove player from game"""
         response = await self.leave_room(player_id)   # response for debugging
         print(response)
+        self.datagram_addresses.pop(player_id, None)
+        self.move_seqs.pop(player_id, None)
+        self.datagram_tokens = {
+            token: token_pid for token, token_pid in self.datagram_tokens.items() if token_pid != player_id
+        }
         rid, _ = self.players.get(player_id, (-1, None))
         # if player doesn't exist, rid will be -1
         # rid is None if player exists without any room
@@ -236,7 +554,7 @@ class GameManager:
         while True:
             try:
                 message = await websocket.recv()    # first message will be 'Get ID'
-                if message != 'MoveTo':  # No spam my logs please
+                if message not in ('MoveTo', 'Input'):  # No spam my logs please
                     print(f'Received: {message}')
 
                 match message:
@@ -271,6 +589,9 @@ class GameManager:
                         if rid in self.room_seeds:
                             await websocket.send("Start Game")
                             await websocket.send(self.room_seeds[rid])
+                            room = self.rooms.get(rid, None)
+                            if room is not None and room.turn_log is not None:
+                                await websocket.send(room.lockstep_history(self.turn_rate))
                     case 'Leave Room':
                         await websocket.send('Enter Player ID')
                         pid = await websocket.recv()
@@ -284,21 +605,25 @@ class GameManager:
                         await websocket.send(output)
                         raise Exception(f'Game over for player {pid}')
                     case 'Help':
-                        await websocket.send('Use /nick [name], /join [room], and /start!')
+                        await websocket.send('Use /nick [name], /join [room], /lockstep, and /start!')
                     case 'Start Game':
                         await websocket.send('Enter Room ID')
                         rid = await websocket.recv()
                         await websocket.send('Enter World Seed')
                         seed = await websocket.recv()
-                        self.room_seeds[int(rid)] = seed
+                        self.set_room_seed(int(rid), seed)
                         print("Starting game with room seed of", seed)
                         await self.broadcast_messages(int(rid), "Start Game")
                         await self.broadcast_messages(int(rid), seed)
+                        self.start_npcs(int(rid), seed)
+                        await self.start_lockstep(int(rid), seed)
                     case 'Change Seed':
                         seed = await websocket.recv()
                         await websocket.send('Enter Room ID')
                         rid = await websocket.recv()
-                        self.room_seeds[int(rid)] = seed
+                        self.set_room_seed(int(rid), seed)
+                        if int(rid) in self.rooms:
+                            self.rooms[int(rid)].add_turn_entry(f"={seed}")
                         await self.broadcast_messages(int(rid), "Change Seed")
                         print("Broadcasting seed change in room", rid, "to", seed)
                         await self.broadcast_messages(int(rid), seed)
@@ -312,13 +637,26 @@ class GameManager:
                         await self.list_players_raw(websocket, rid)
                     case 'MoveTo':
                         target = await websocket.recv()
-                        pid = target.split(",", maxsplit=1)[0]
-                        await self.send_messages_in_chat(int(pid), message + ": " + target)
+                        await self.move_player(websocket, target)
+                    case 'Datagram Channel':
+                        await websocket.send(self.offer_datagrams(websocket, pid))
+                    case 'Input':
+                        target = await websocket.recv()
+                        self.queue_input(websocket, target)
+                    case 'Lockstep Room':
+                        await websocket.send('Enter Room ID')
+                        rid = await websocket.recv()
+                        try:
+                            output = self.set_lockstep(int(rid))
+                        except ValueError:
+                            output = f"Bad room id: {rid}"
+                        await websocket.send(output)
                     case 'Room Seed':
                         await websocket.send('Enter Room ID')
                         rid = await websocket.recv()
-                        print("Giving in-progress joiner the room seed:", self.room_seeds[int(rid)])
-                        await websocket.send(self.room_seeds[int(rid)])
+                        seed = self.room_seeds.get(int(rid), "")
+                        print("Giving in-progress joiner the room seed:", seed)
+                        await websocket.send(f"RoomSeed: {seed}")
                     case 'Play Sound':
                         sound = await websocket.recv()
                         await websocket.send('Enter Room ID')
@@ -377,10 +715,16 @@ class GameManager:
             all_players = room.room_players.keys()
             for player_id in all_players:
                 players.append((player_id, room.room_players[player_id]))
-        await websocket.send("|".join(f"{p[0]},{p[1]}" for p in players))
+        await websocket.send("PlayersRaw: " + "|".join(f"{p[0]},{p[1]}" for p in players))
 
     async def main(self):
         """Main asyncio function to start server"""
+        try:
+            _transport, self.datagrams = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: DatagramChannel(self.datagram_received), local_addr=('0.0.0.0', self.datagram_port)
+            )
+        except OSError as e_mess:
+            print(f'Server message: No datagram channel, movement goes over websockets ({e_mess})')
         async with websockets.serve(self.start_game, '', 8001, ping_interval=None, ping_timeout=None):
             print('Server started')
             await asyncio.Future()
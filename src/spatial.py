@@ -0,0 +1,189 @@
+from typing import Iterable, Optional
+
+import numpy as np
+import pygame
+
+from .entities import EntityStore
+
+NO_CELL = -1
+KEY_OFFSET = 2**30  # Cell coordinates are offset to be positive, then packed into one integer key
+KEY_SPAN = 2**31
+
+
+def _cell_key(cell_x, cell_y):
+    return (cell_x + KEY_OFFSET) * KEY_SPAN + (cell_y + KEY_OFFSET)
+
+
+class SpatialHash:
+    """
+    A uniform grid over the positions of an EntityStore, for proximity and collision queries
+
+    Rows are moved between cells as the store reports them moving, so only entities that
+    cross into another cell cost anything, and queries only look at the cells they cover.
+    Distances don't wrap around the edges of the world.
+    """
+
+    def __init__(self, store: EntityStore, cell_size: int = 64):
+        self.store = store
+        self.cell_size = cell_size
+        self.cells: dict[int, set[int]] = {}
+        self.size = 0
+        self._keys = np.full(store.capacity, NO_CELL, np.int64)
+        store.listen(self.update)
+        self.update(np.flatnonzero(store.alive[:store.count]))
+
+    def close(self) -> None:
+        """Stop following the store, such as once the game using the hash is done with."""
+        self.store.unlisten(self.update)
+
+    def update(self, rows: np.ndarray) -> None:
+        """Move rows into the cells of their current positions."""
+        store = self.store
+        if len(self._keys) < store.capacity:
+            grown = np.full(store.capacity, NO_CELL, np.int64)
+            grown[:len(self._keys)] = self._keys
+            self._keys = grown
+
+        cell_x = np.floor_divide(store.x[rows], self.cell_size).astype(np.int64)
+        cell_y = np.floor_divide(store.y[rows], self.cell_size).astype(np.int64)
+        keys = np.where(store.alive[rows], _cell_key(cell_x, cell_y), NO_CELL)
+        old_keys = self._keys[rows]
+        changed = keys != old_keys
+
+        for row, old_key, key in zip(rows[changed].tolist(), old_keys[changed].tolist(), keys[changed].tolist()):
+            if old_key != NO_CELL:
+                cell = self.cells[old_key]
+                cell.discard(row)
+                if not cell:
+                    del self.cells[old_key]
+                self.size -= 1
+            if key != NO_CELL:
+                self.cells.setdefault(key, set()).add(row)
+                self.size += 1
+        self._keys[rows] = keys
+
+    def _candidates(self, left: float, top: float, right: float, bottom: float) -> np.ndarray:
+        """Rows in every cell touching an area, some of which may be outside it."""
+        first_x, last_x = int(left // self.cell_size), int(right // self.cell_size)
+        first_y, last_y = int(top // self.cell_size), int(bottom // self.cell_size)
+
+        if (last_x - first_x + 1) * (last_y - first_y + 1) <= len(self.cells):
+            cells = (
+                self.cells.get(_cell_key(cell_x, cell_y))
+                for cell_x in range(first_x, last_x + 1)
+                for cell_y in range(first_y, last_y + 1)
+            )
+        else:
+            # A huge area, it's quicker to go through the occupied cells
+            cells = (
+                cell
+                for key, cell in self.cells.items()
+                if first_x <= key // KEY_SPAN - KEY_OFFSET <= last_x
+                and first_y <= key % KEY_SPAN - KEY_OFFSET <= last_y
+            )
+        return np.fromiter((row for cell in cells if cell for row in cell), np.int64)
+
+    def in_rect(self, rect: pygame.Rect) -> np.ndarray:
+        """Rows positioned inside a rect."""
+        rect = pygame.Rect(rect)
+        rows = self._candidates(rect.left, rect.top, rect.right, rect.bottom)
+        x, y = self.store.x[rows], self.store.y[rows]
+        return rows[(x >= rect.left) & (x < rect.right) & (y >= rect.top) & (y < rect.bottom)]
+
+    def in_radius(self, x: float, y: float, radius: float) -> np.ndarray:
+        """Rows within a distance of a point."""
+        rows = self._candidates(x - radius, y - radius, x + radius, y + radius)
+        distances = np.hypot(self.store.x[rows] - x, self.store.y[rows] - y)
+        return rows[distances <= radius]
+
+    def nearest(self, x: float, y: float, count: int = 1, exclude: Iterable[int] = ()) -> np.ndarray:
+        """The rows closest to a point, nearest first, searching outwards until enough are found."""
+        exclude = np.fromiter(set(exclude), np.int64)
+        available = self.size - sum(1 for row in exclude.tolist() if self._keys[row] != NO_CELL)
+        wanted = min(count, available)
+        if wanted <= 0:
+            return np.zeros(0, np.int64)
+
+        # Everything within a radius is found, so once there are enough they include the nearest
+        radius = self.cell_size
+        while True:
+            rows = self.in_radius(x, y, radius)
+            rows = rows[~np.isin(rows, exclude)]
+            if len(rows) >= wanted:
+                break
+            radius *= 2
+
+        distances = np.hypot(self.store.x[rows] - x, self.store.y[rows] - y)
+        return rows[np.argsort(distances, kind="stable")[:count]]
+
+    def views(self, rows: np.ndarray) -> list:
+        """The objects, such as Characters, viewing some rows."""
+        views = self.store.views
+        return [views[row] for row in rows.tolist() if row in views]
+
+
+class TileGrid:
+    """
+    The tiles of a map, for proximity and collision queries against the terrain
+
+    A map is already a uniform grid, so queries go straight to the tiles they cover.
+    Tiles are (column, row) pairs, and positions are in map pixels.
+    """
+
+    def __init__(self, columns: list[list[str]], tile_size: int = 16):
+        self.tiles = np.array(columns, dtype="<U1")  # Indexed [column, row], like the map
+        self.tile_size = tile_size
+
+    def at(self, x: float, y: float) -> Optional[str]:
+        """The kind of tile at a position, or None off the map."""
+        column, row = int(x // self.tile_size), int(y // self.tile_size)
+        if 0 <= column < self.tiles.shape[0] and 0 <= row < self.tiles.shape[1]:
+            return str(self.tiles[column, row])
+        return None
+
+    def _area(self, left: float, top: float, right: float, bottom: float) -> tuple[slice, slice]:
+        """The columns and rows of tiles overlapping an area, clipped to the map."""
+        columns, rows = self.tiles.shape
+        return (
+            slice(max(0, int(left // self.tile_size)), min(columns, -int(-right // self.tile_size))),
+            slice(max(0, int(top // self.tile_size)), min(rows, -int(-bottom // self.tile_size))),
+        )
+
+    def _matching(self, area: tuple[slice, slice], kinds: Optional[Iterable[str]]) -> np.ndarray:
+        """The tiles of an area, optionally only those of some kinds."""
+        block = self.tiles[area]
+        mask = np.ones(block.shape, bool) if kinds is None else np.isin(block, list(kinds))
+        tiles = np.argwhere(mask)
+        tiles[:, 0] += area[0].start
+        tiles[:, 1] += area[1].start
+        return tiles
+
+    def in_rect(self, rect: pygame.Rect, kinds: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Tiles overlapping a rect, such as the rect of a sprite."""
+        rect = pygame.Rect(rect)
+        return self._matching(self._area(rect.left, rect.top, rect.right, rect.bottom), kinds)
+
+    def in_radius(self, x: float, y: float, radius: float, kinds: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Tiles with their centre within a distance of a point."""
+        tiles = self._matching(self._area(x - radius, y - radius, x + radius + 1, y + radius + 1), kinds)
+        return tiles[self._distances(tiles, x, y) <= radius]
+
+    def nearest(self, x: float, y: float, count: int = 1, kinds: Optional[Iterable[str]] = None) -> np.ndarray:
+        """The tiles with their centres closest to a point, nearest first."""
+        kinds = None if kinds is None else list(kinds)
+        width, height = self.tile_size * np.array(self.tiles.shape)
+        # Past the farthest corner of the map, there's nothing more to find
+        reach = np.hypot(max(x, width - x), max(y, height - y))
+
+        radius = self.tile_size
+        while True:
+            tiles = self.in_radius(x, y, radius, kinds)
+            if len(tiles) >= count or radius > reach:
+                break
+            radius *= 2
+
+        return tiles[np.argsort(self._distances(tiles, x, y), kind="stable")[:count]]
+
+    def _distances(self, tiles: np.ndarray, x: float, y: float) -> np.ndarray:
+        centres = (tiles + 0.5) * self.tile_size
+        return np.hypot(centres[:, 0] - x, centres[:, 1] - y)
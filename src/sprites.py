@@ -1,13 +1,30 @@
 import pygame
 
+from . import assets
+
+MINI_ROUGELIKE = "sprites/colored_tilemap.png"
+MODERN_CITY = "sprites/roguelikeSheet_transparent.png"
+
+# Background colour of the mini roguelike sheet, keyed out of its tiles.
+COLORKEY = (34, 35, 35)
+
 
 class SpriteSheet:
     """Class for loading and parsing spritesheets."""
 
+    _loaded: dict[str, "SpriteSheet"] = {}
+
     def __init__(self, filename):
         """Load the spritesheet."""
         self.sheet = pygame.image.load(filename).convert()
 
+    @classmethod
+    def load(cls, filename: str) -> "SpriteSheet":
+        """Load a spritesheet once per process, reusing it on later calls."""
+        if filename not in cls._loaded:
+            cls._loaded[filename] = cls(filename)
+        return cls._loaded[filename]
+
     def image_at(self, rectangle):
         """Load a single image from the spritesheet.
 
@@ -24,162 +41,144 @@ class ImportantSprites:
     """Class including some important sprites
 
     Note all sprits are 1x1 tile (16x16 pixels)
+
+    Textures are cut from their sheets, scaled and colorkeyed on first use, then
+    shared by every instance for the rest of the process. The returned surfaces
+    are shared, so they must not be modified.
     """
 
-    def __init__(self) -> None:
-        self._miniRougelike = SpriteSheet("sprites/colored_tilemap.png")
-        self._modernCity = SpriteSheet("sprites/roguelikeSheet_transparent.png")
+    # name: (sheet, x, y, size in the sheet)
+    TILES = {
+        "flowers": (MODERN_CITY, (16 * 3) + 3, (16 * 7) + 7, 16),
+        "water": (MODERN_CITY, (16 * 3) + 3, (16 * 1) + 1, 16),
+        "grass": (MODERN_CITY, (16 * 3) + 3, (16 * 16) + 16, 16),
+        "potion": (MINI_ROUGELIKE, (8 * 7) + 7, (8 * 8) + 8, 8),
+        "sword": (MINI_ROUGELIKE, (8 * 6) + 6, (8 * 4) + 4, 8),
+        "axe": (MINI_ROUGELIKE, (8 * 7) + 7, (8 * 4) + 4, 8),
+        "crossbow": (MINI_ROUGELIKE, (8 * 8) + 8, (8 * 4) + 4, 8),
+        "arrow": (MINI_ROUGELIKE, (8 * 9) + 9, (8 * 4) + 4, 8),
+        "trident": (MINI_ROUGELIKE, (8 * 10) + 10, (8 * 4) + 4, 8),
+        "club": (MINI_ROUGELIKE, (8 * 10) + 10, (8 * 3) + 3, 8),
+        "chest": (MINI_ROUGELIKE, (8 * 9) + 9, (8 * 3) + 3, 8),
+        "empty_heart": (MINI_ROUGELIKE, (8 * 7) + 7, (8 * 5) + 5, 8),
+        "half_heart": (MINI_ROUGELIKE, (8 * 8) + 8, (8 * 5) + 5, 8),
+        "full_heart": (MINI_ROUGELIKE, (8 * 9) + 9, (8 * 5) + 5, 8),
+        "character1": (MINI_ROUGELIKE, (8 * 4) + 4, 0, 8),
+        "character2": (MINI_ROUGELIKE, (8 * 5) + 5, 0, 8),
+        "character3": (MINI_ROUGELIKE, (8 * 6) + 6, 0, 8),
+        "character4": (MINI_ROUGELIKE, (8 * 7) + 7, 0, 8),
+        "character5": (MINI_ROUGELIKE, (8 * 10) + 10, 0, 8),
+        "character6": (MINI_ROUGELIKE, (8 * 11) + 11, 0, 8),
+    }
+
+    _textures: dict[str, pygame.Surface] = {}
+
+    @classmethod
+    def get(cls, name: str) -> pygame.Surface:
+        """Get a texture by name, building and caching it on first use."""
+        texture = cls._textures.get(name)
+        if texture is None:
+            texture = cls._textures[name] = cls._make_texture(name)
+        return texture
+
+    @classmethod
+    def preload(cls):
+        """Build every texture up front, so later lookups never touch the disk."""
+        for name in cls.TILES:
+            cls.get(name)
+
+    @classmethod
+    def _make_texture(cls, name: str, use_pack: bool = True) -> pygame.Surface:
+        """Cut a tile from the baked asset pack, or from its sheet, and convert it for fast blitting."""
+        pack = assets.get_pack() if use_pack else None
+        if pack is not None and pack.has_tiles(cls.TILES):
+            return pack.tile(name)
+
+        sheet, x, y, size = cls.TILES[name]
+        image = SpriteSheet.load(sheet).image_at((x, y, x + size, y + size))
+        if sheet == MINI_ROUGELIKE:
+            image = pygame.transform.scale2x(image).convert()
+            image.set_colorkey(COLORKEY, pygame.RLEACCEL)
+        else:
+            image = image.convert()
+        return image
 
     def get_flowers(self) -> pygame.Surface:
         """Get the image for flowers"""
-        x = (16 * 3) + 3
-        y = (16 * 7) + 7
-        return self._modernCity.image_at((x, y, x + 16, y + 16))
+        return self.get("flowers")
 
     def get_water(self) -> pygame.Surface:
         """Get the image for water"""
-        x = (16 * 3) + 3
-        y = (16 * 1) + 1
-        return self._modernCity.image_at((x, y, x + 16, y + 16))
+        return self.get("water")
 
     def get_grass(self) -> pygame.Surface:
         """Get the image for grass"""
-        x = (16 * 3) + 3
-        y = (16 * 16) + 16
-        return self._modernCity.image_at((x, y, x + 16, y + 16))
+        return self.get("grass")
 
     def get_potion(self) -> pygame.Surface:
         """Get the image of a potion"""
-        x = (8 * 7) + 7
-        y = (8 * 8) + 8
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("potion")
 
     def get_sword(self) -> pygame.Surface:
         """Get the image of a sword"""
-        x = (8 * 6) + 6
-        y = (8 * 4) + 4
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("sword")
 
     def get_axe(self) -> pygame.Surface:
         """Get the image of an axe"""
-        x = (8 * 7) + 7
-        y = (8 * 4) + 4
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("axe")
 
     def get_crossbow(self) -> pygame.Surface:
         """Get the image of a crossbow"""
-        x = (8 * 8) + 8
-        y = (8 * 4) + 4
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("crossbow")
 
     def get_arrow(self) -> pygame.Surface:
         """Get the image of an arrow"""
-        x = (8 * 9) + 9
-        y = (8 * 4) + 4
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("arrow")
 
     def get_trident(self) -> pygame.Surface:
         """Get the image of a trident"""
-        x = (8 * 10) + 10
-        y = (8 * 4) + 4
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("trident")
 
     def get_club(self) -> pygame.Surface:
         """Get the image of a club"""
-        x = (8 * 10) + 10
-        y = (8 * 3) + 3
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("club")
 
     def get_chest(self) -> pygame.Surface:
         """Get the image of a chest"""
-        x = (8 * 9) + 9
-        y = (8 * 3) + 3
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("chest")
 
     def get_empty_heart(self) -> pygame.Surface:
         """Get the image of an empty heart"""
-        x = (8 * 7) + 7
-        y = (8 * 5) + 5
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("empty_heart")
 
     def get_half_heart(self) -> pygame.Surface:
         """Get the image of a half heart"""
-        x = (8 * 8) + 8
-        y = (8 * 5) + 5
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("half_heart")
 
     def get_full_heart(self) -> pygame.Surface:
         """Get the image of a full heart"""
-        x = (8 * 9) + 9
-        y = (8 * 5) + 5
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("full_heart")
 
     def get_character1(self) -> pygame.Surface:
         """Get the image of a character"""
-        x = (8 * 4) + 4
-        y = 0
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("character1")
 
     def get_character2(self) -> pygame.Surface:
         """Get the image of a character"""
-        x = (8 * 5) + 5
-        y = 0
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("character2")
 
     def get_character3(self) -> pygame.Surface:
         """Get the image of a character"""
-        x = (8 * 6) + 6
-        y = 0
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("character3")
 
     def get_character4(self) -> pygame.Surface:
         """Get the image of a character"""
-        x = (8 * 7) + 7
-        y = 0
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("character4")
 
     def get_character5(self) -> pygame.Surface:
         """Get the image of a character"""
-        x = (8 * 10) + 10
-        y = 0
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("character5")
 
     def get_character6(self) -> pygame.Surface:
         """Get the image of a character"""
-        x = (8 * 11) + 11
-        y = 0
-        return pygame.transform.scale2x(
-            (self._miniRougelike.image_at((x, y, x + 8, y + 8)))
-        )
+        return self.get("character6")
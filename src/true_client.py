@@ -1,18 +1,33 @@
 import asyncio
+import math
+import queue
 import random
+import threading
+import time
 import traceback
 from collections import deque
+from typing import Optional
+from urllib.parse import urlparse
 
+import numpy as np
 import pygame
 import websockets
 
 from . import game
+from .audio import SoundBank
 from .character import Character
-from .maps import MapGen, MapSprite
+from .datagrams import DatagramChannel
+from .entities import EntityStore
+from .lockstep import Lockstep
+from .mapgen import MAP_SHAPE, MapGen
+from .maps import MapSprite
+from .netsync import SnapshotBuffer
+from .ui import InputBuffer, TextCache
 
 black = (0, 0, 0)
 white = (255, 255, 255)
 grey = (200, 200, 200)
+FONT_SIZE = 22  # Pygame's bundled font, at about the size of 16pt Arial
 
 options_dict = {
     1: "See rooms",
@@ -22,35 +37,100 @@ options_dict = {
     5: "Leave Game",
     6: "Exit Game",
 }
+special_commands = ["Join Room", "List Players", "Start Game", "Lockstep Room"]
+
+# How many times the server prompts us for something after each command. Nothing else
+# can be sent until they're answered, or the server would take it as the answer.
+command_prompts = {
+    "Create Room": 1,
+    "Join Room": 2,
+    "Leave Room": 1,
+    "Leave Game": 1,
+    "Start Game": 2,
+    "Change Seed": 1,
+    "List Players": 1,
+    "List PlayersRaw": 1,
+    "Room Seed": 1,
+    "Play Sound": 1,
+    "Lockstep Room": 1,
+    "/nick": 1,
+}
+PROMPT_TIMEOUT = 5  # Seconds to wait on the server's prompts or reply before sending anyway
+MOVE_RATE = 15  # Most times a second our position is sent
+DATAGRAM_HELLOS = 10  # Times to try opening the datagram channel, half a second apart, before staying on the websocket
+RESEND_AFTER = 0.25  # Seconds to wait for a move sent by datagram to be acknowledged before sending it again
+MAX_RESENDS = 8  # Times to send a move again before giving up, such as when we're not in a room to be acknowledged
 
 
 class Player:
     """Handle asynchronous player creation, input and communication with server"""
 
-    def __init__(self, websocket_url: str = 'ws://localhost:8001'):
+    def __init__(
+        self,
+        websocket_url: str = 'ws://localhost:8001',
+        move_rate: float = MOVE_RATE,
+        datagrams: bool = True,
+    ):
         self.game = None
         self.name = "Missing"
         # self.websocket = websocket
         self._pid_ = None
+        self.connected = threading.Event()  # Set once the server has given us a player ID
         self.rid = "0"
         self.running = True
         self.game_rect = None
         self.texts = deque()
-        self.text_buffer = []
+        self.input_buffer = InputBuffer()
         self.shift_active = False
         self.menu_rects = []
         self.updated_rects = []
-        self.font = pygame.font.SysFont('Arial', 16)
+        self.font = None
+        self.text_cache = None
+        self.chat_rows = []
         self.text_edi_rect = None
         self.comm_text = None
         self.in_game = False
         self.character = None
-        self.game_data_pending = []
+        self.map_sprite = None
+        self.regions = None  # Regions of the current map, to pick spawn points from
+        self.map_seed = 0
         self.characters = {}
         self.websocket_url = websocket_url
-        self.to_play = []
         self.counter = 0
 
+        # The network runs on an asyncio loop in another thread. Messages to send go in the
+        # outbox, and whatever the server sends is handled on the game's thread through the inbox.
+        self.loop = None
+        self.outbox = None
+        self.inbox = queue.SimpleQueue()
+        self.answered = None  # Released each time we answer one of the server's prompts
+        self.reply = None  # Future for the reply to the command being sent, if it gets one
+        self.reply_prefix = None  # What the reply starts with, so other messages aren't taken for it
+        self.sending = None  # Held while sending, so moves don't land between a command and its answers
+        self.tasks = set()  # Running background tasks, which the event loop only weakly references
+        self.game_started = False
+
+        # Only our latest position is kept for sending, so a slow connection never builds a backlog
+        if not move_rate > 0:
+            raise ValueError(f"Move rate must be more than 0, not {move_rate}")
+        self.move_rate = move_rate
+        self.latest_move = None  # (x, y, send straight away), or None once sent
+        self.move_lock = threading.Lock()
+        self.move_ready = None
+        self.move_seq = 0
+        self.unacked = deque(maxlen=64)  # (seq, x, y) of moves sent, until the server acknowledges them
+
+        # Movement goes over UDP once the server has a datagram channel for us and we've heard back on it
+        self.use_datagrams = datagrams
+        self.datagrams = None
+        self.datagram_token = None
+        self.datagram_ready = False
+
+        # In a lockstep room, players are moved by the turns the server relays, and we only send our keys
+        self.lockstep = None
+        self.early_turns = []  # Turns that came before the room's Lockstep message
+        self.held_keys = set()
+
         # Init chat tracking
 
         self.chat_w_start = 900
@@ -63,11 +143,36 @@ class Player:
         self.width = self.screen.get_width()
         self.height = self.screen.get_height()
         self.texts = deque(self.texts, maxlen=(self.height - self.chat_h_start - 80)//20)
+        # Loading pygame's own font file avoids scanning the system's fonts
+        self.font = pygame.font.Font(None, FONT_SIZE)
+        self.text_cache = TextCache(self.font)
         self.make_screen()
-        self.map_width = 895 // 16
-        self.map_height = self.height // 16 - 1
+        self.game.set_layer_static(-3)
+        self.map_width, self.map_height = MAP_SHAPE
+
+        # The map is the world, seen through a camera inside the game panel
+        world_size = (16 * self.map_width, 16 * self.map_height)
+        self.game.camera.world_size = world_size
+        self.game.camera.viewport = pygame.Rect(5, 5, min(885, world_size[0]), min(self.height - 10, world_size[1]))
 
-        self.sounds = self.game.load_audio_folder("src/audio")
+        # Remote characters are drawn a little behind the server, smoothing between its updates
+        self.remote = SnapshotBuffer(game.entities)
+        self.game.add_system(self.remote)
+
+        self.sounds = SoundBank("src/audio")
+        self.key_sound_map = dict(zip(
+            [
+                pygame.K_1,
+                pygame.K_2,
+                pygame.K_3,
+                pygame.K_4,
+                pygame.K_5,
+                pygame.K_6,
+                pygame.K_7,
+                pygame.K_8,
+            ],
+            self.sounds.keys(),
+        ))
 
     def make_screen(self):
         """Set up the initial ui."""
@@ -86,6 +191,8 @@ class Player:
     def pid(self, player_id):
         """Setter for player ID"""
         self._pid_ = player_id
+        if player_id is not None:
+            self.connected.set()
 
     @staticmethod
     def print_options():
@@ -102,7 +209,7 @@ class Player:
         """Draw the menu panel."""
         menu_w_start = 1050
         for start_height, text in zip(range(20, 260, 35), options_dict.values()):
-            rendered_text = self.font.render(text, True, black)
+            rendered_text = self.text_cache.render(text)
             rect = pygame.draw.rect(
                 self.screen,
                 (66, 155, 245),
@@ -117,7 +224,7 @@ class Player:
         self.server_rects = []
         self.chat_bars = []
 
-        text = self.font.render("Server messages", True, black)
+        text = self.text_cache.render("Server messages")
 
         self.screen.fill(white, (self.chat_w_start+5, 235, self.width, self.height))
 
@@ -133,7 +240,7 @@ class Player:
         for i in range(260, self.chat_h_start - 60, 20):
             self.server_rects.append(pygame.Rect((self.chat_w_start+5, i, self.width-(self.chat_w_start+18), 20)))
 
-        text = self.font.render(f"Chat room (You are {self.name})", True, black)
+        text = self.text_cache.render(f"Chat room (You are {self.name})")
         self.screen.blit(text, (self.chat_w_start+5, self.chat_h_start-20))
 
         self.text_edi_rect = pygame.Rect(self.chat_w_start+1, self.chat_h_start+1, 289, 30)
@@ -147,35 +254,16 @@ class Player:
 
         for rect in self.chat_bars:
             pygame.draw.rect(self.screen, black, rect, width=1)
+        # Text currently drawn in each chat bar, so only changed rows are redrawn
+        self.chat_rows = [None] * len(self.chat_bars)
+
+        self.updated_rects.append(
+            pygame.Rect(self.chat_w_start, 235, self.width - self.chat_w_start, self.height - 235)
+        )
 
     def print_buffer(self):
         """Turn the text buffer into manipulable text."""
-        temp_buffer = []
-        shift_on = False
-        counter = 0
-        for i in self.text_buffer:
-            if i.endswith("start"):
-                shift_on = True
-                continue
-            elif i.endswith("end"):
-                shift_on = False
-                continue
-            elif i == "back":
-                if temp_buffer:
-                    temp_buffer.pop()
-                continue
-
-            counter += len(i)
-            if counter > 20:
-                temp_buffer.append("\n")
-                counter = 0
-
-            if shift_on:
-                temp_buffer.append(i.upper())
-            else:
-                temp_buffer.append(i)
-
-        return "".join(temp_buffer)
+        return str(self.input_buffer)
 
     def handle_command(self):
         """Process a command that starts with /."""
@@ -187,24 +275,20 @@ class Player:
             self.chat_panel()
         elif command.startswith("/list"):
             self.comm_text = "List Players"
+        elif command.startswith("/lockstep"):
+            self.comm_text = "Lockstep Room"
         elif command.startswith("/start"):
             print("Starting game")
             self.in_game = True
 
-            mapGenerator = MapGen((self.map_width, self.map_height))
-            mapGenerator.generate_noise()
+            mapGenerator = self.generate_map()
             self.seed = mapGenerator.seed
-            mapGenerator.convert()
             map = MapSprite(x=5, y=5)
             map.register_from_string(mapGenerator.export_to_string())
-            self.map_sprite = map
-            self.game.add_sprite(-3, map)
+            self.replace_map(map)
             self.comm_text = "Start Game"
-            self.character = Character(
-                spawn_position=(50 * self.pid + 50, 50)
-            )
-            self.game.add_sprite(3, self.character)
-            self.game.add_handler(self.character.input, pygame.KEYUP, pygame.KEYDOWN)
+            if self.lockstep is None:
+                self.control_character()
 
         elif command.startswith("/join"):
             self.comm_text = "Join Room"
@@ -215,100 +299,354 @@ class Player:
         print("Starting game")
         self.in_game = True
 
-        mapGenerator = MapGen((self.map_width, self.map_height), seed=int(seed))
-        mapGenerator.generate_noise()
-        mapGenerator.convert()
+        mapGenerator = self.generate_map(int(seed))
         map = MapSprite(x=5, y=5)
         map.register_from_string(mapGenerator.export_to_string())
+        self.replace_map(map)
+
+    def generate_map(self, seed: int = None) -> MapGen:
+        """Generate the map of a seed, and stop characters walking over its water."""
+        mapGenerator = MapGen(MAP_SHAPE, seed=seed)
+        mapGenerator.generate_noise()
+        mapGenerator.convert()
+        self.game.entities.walk_mask = mapGenerator.walk_mask()
+        self.regions = mapGenerator.regions()
+        self.map_seed = mapGenerator.seed
+        return mapGenerator
+
+    def replace_map(self, map: MapSprite):
+        """Show a new map sprite in place of the current one."""
+        if self.map_sprite is not None:
+            self.game.remove_sprite(self.map_sprite)
         self.map_sprite = map
+        map.camera = self.game.camera
         self.game.add_sprite(-3, map)
 
     def change_seed(self, seed: str):
         """Replace the current map with a new one from a new seed."""
-        mapGenerator = MapGen((self.map_width, self.map_height), seed=int(seed))
-        mapGenerator.generate_noise()
-        mapGenerator.convert()
+        mapGenerator = self.generate_map(int(seed))
         self.map_sprite.register_from_string(mapGenerator.export_to_string())
-        self.updated_rects.append(self.screen.get_rect())
+        self.game.invalidate(self.map_sprite)
 
-    async def create_players(self, websocket):
+    async def create_players(self):
+        """Fetch the players in our room, then create their sprites on the game's thread."""
+        players = await self.request(
+            "List PlayersRaw", prompts=command_prompts["List PlayersRaw"], prefix="PlayersRaw: "
+        )
+        self.post(self.add_players, players)
+
+    async def join_game_in_progress(self):
+        """Fetch the map of a game that started before we joined its room."""
+        seed = await self.request("Room Seed", prompts=command_prompts["Room Seed"], prefix="RoomSeed: ")
+        if not seed:
+            print("Room hasn't got a seed yet")
+            return
+        print("Got in progress room seed:", seed)
+        self.post(self.start_game_client, seed)
+
+    def add_players(self, players: str):
         """Create player sprites for each player in the game."""
-        await websocket.send("List PlayersRaw")
-        assert await websocket.recv() == 'Enter Room ID'
-        await websocket.send(str(self.rid))
-        players = await websocket.recv()
-        players = players.split("|")
-        # Now we have player_id, nick pairings
-        players = [i.split(",") for i in players]
+        if self.lockstep is not None:
+            return  # Players come and go with the lockstep turns
+        players = players.split("|") if players else []
+        # Now we have player_id, nick pairings, and nicks can have commas
+        players = [i.split(",", maxsplit=1) for i in players]
 
         for pid, nick in players:
-            character = Character(
-                spawn_position=(int(pid)*50 + 50, 50),
-                max_x=self.screen.get_width(),
-                max_y=self.screen.get_height(),
-            )
+            if pid in self.characters:
+                continue  # Already seen moving
+            character = self.make_character(pid)
             print("New remote character:", pid, nick)
             self.game.add_sprite(2, character)
             self.characters[pid] = character
 
-        character = Character(
-            spawn_position=(int(self.pid) * 50 + 50, 50),
-            max_x=self.screen.get_width(),
-            max_y=self.screen.get_height(),
-        )
-        self.character = character
+        self.control_character()
+
+    def control_character(self):
+        """Create our own character, in place of any we had, moved by the keyboard and sent to the server."""
+        if self.character is not None:
+            self.game.remove_sprite(self.character)
+        self.character = self.make_character(self.pid)
+        self.game.camera.follow(self.character)
         self.game.add_sprite(3, self.character)
-        self.game.add_handler(self.character.input, pygame.KEYUP, pygame.KEYDOWN)
+        keys = self.character.MOVEMENT_KEYS
+        self.game.add_handler(self.character.input, pygame.KEYUP, pygame.KEYDOWN, keys=keys)
+        # After the character has handled the key, so it knows whether it stopped
+        self.game.add_handler(self.movement_key_up, pygame.KEYUP, keys=keys, priority=-1, owner=self.character)
         self.character.special_input = self.send_char_data
 
+    def make_character(
+        self,
+        pid: str,
+        spawn_position: Optional[tuple] = None,
+        store: Optional[EntityStore] = None,
+    ) -> Character:
+        """Create the character of a player, bounded by and drawn through the game's camera."""
+        world_width, world_height = self.game.camera.world_size
+        if spawn_position is None and self.regions is not None:
+            # Seeded by the map and player, so every client spawns a player at the same place
+            spawner = np.random.default_rng([self.map_seed & 0xFFFFFFFF, int(pid) & 0xFFFFFFFF])
+            spawn_position = self.regions.spawn_point(spawner)
+        elif spawn_position is None:
+            spawn_position = (int(pid)*50 + 50, 50)
+        character = Character(
+            spawn_position=spawn_position,
+            max_x=world_width,
+            max_y=world_height,
+            store=store,
+        )
+        character.camera = self.game.camera
+        return character
+
+    def start_lockstep(self, message: str):
+        """
+        Play the lockstep game of our room, from its Lockstep message
+
+        Every player's character, ours too, is moved by the turns the server relays, so our
+        movement keys go to the server rather than straight to a character of our own.
+        """
+        header, *turns = message.split("\n")
+        closed, turn_rate, seed = header.removeprefix("Lockstep: ").split(",")
+        if self.lockstep is None:
+            self.game.add_handler(self.send_input, pygame.KEYUP, pygame.KEYDOWN, keys=Character.MOVEMENT_KEYS)
+        else:
+            # A new game, the old one's characters go
+            for pid in list(self.lockstep.characters):
+                self.lockstep.leave(pid)
+            self.game.systems.remove(self.lockstep)
+
+        if self.character is not None:
+            self.game.remove_sprite(self.character)
+            self.character.special_input = None
+            self.character = None
+        for pid in [pid for pid in self.characters if int(pid) >= 0]:
+            # Seen moving before the game went into lockstep, they'll join with the turns
+            self.game.remove_sprite(self.characters.pop(pid))
+
+        self.lockstep = Lockstep(int(seed), float(turn_rate), self.spawn_lockstep, self.despawn_lockstep, int(closed))
+        self.lockstep.extend(turns)
+        self.lockstep.extend(self.early_turns)
+        self.early_turns.clear()
+        self.game.add_system(self.lockstep)
+
+    def spawn_lockstep(self, pid: int, position: tuple, store: EntityStore) -> Character:
+        """Create the character of a player joining the lockstep game."""
+        character = self.make_character(str(pid), spawn_position=position, store=store)
+        if pid == self.pid:
+            self.game.camera.follow(character)
+            self.game.add_sprite(3, character)
+        else:
+            print("New lockstep character:", pid)
+            self.game.add_sprite(2, character)
+        return character
+
+    def despawn_lockstep(self, pid: int, character: Character):
+        """Remove the character of a player leaving the lockstep game."""
+        self.game.remove_sprite(character)
+
+    def apply_turn(self, message: str):
+        """Pass a Turn message to the lockstep game, keeping it until the game starts if it hasn't."""
+        if self.lockstep is None:
+            self.early_turns.append(message)
+        else:
+            self.lockstep.add(message)
+
+    def send_input(self, event):
+        """Send the server a change in which movement keys we hold, for the next lockstep turn."""
+        down = event.type == pygame.KEYDOWN
+        if (event.key in self.held_keys) == down:
+            return  # Already sent, such as a key repeat
+        if down:
+            self.held_keys.add(event.key)
+        else:
+            self.held_keys.discard(event.key)
+        self.send("Input", f"{self.pid},{event.key},{int(down)}")
+
     def send_char_data(self, character: Character):
         """Send update data through the websocket for movement."""
-        self.game_data_pending.append(("MoveTo", self.pid, character.x, character.y))
-
-    def update_character(self, pid: str, x: int, y: int):
-        """Update a character sprite."""
+        self.queue_move(character.x, character.y)
+
+    def movement_key_up(self, event):
+        """Send where our character stopped straight away, rather than at the next rate limited send."""
+        if self.character.direction == (0, 0):
+            self.queue_move(self.character.x, self.character.y, now=True)
+
+    def queue_move(self, x: int, y: int, now: bool = False):
+        """Set the position to send next, replacing any not sent yet, from any thread."""
+        with self.move_lock:
+            waiting = self.latest_move is not None
+            self.latest_move = (x, y, now or (waiting and self.latest_move[2]))
+        if self.loop is not None and (now or not waiting):
+            self.loop.call_soon_threadsafe(self.move_ready.set)
+
+    def update_character(self, pid: str, x: int, y: int, server_time: Optional[float] = None):
+        """Update a character sprite, through the snapshot buffer if the move has a server time."""
         if int(pid) == self.pid:
             return  # We already handle our own
+        if self.lockstep is not None and int(pid) >= 0:
+            return  # Players are moved by the lockstep turns, only NPCs are sent as positions
 
         if pid not in self.characters:
-            character = Character(
-                spawn_position=(int(pid)*50 + 50, 50),
-                max_x=self.screen.get_width(),
-                max_y=self.screen.get_height(),
-            )
+            character = self.make_character(pid)
+            if int(pid) < 0:
+                character.image = character.sprites.get_character2()  # NPCs look different to players
             print("New remote character:", pid)
             self.game.add_sprite(2, character)
             self.characters[pid] = character
-
-        self.characters[pid].x = x
-        self.characters[pid].y = y
+            self.remote.reset(character.row)
+            character.x, character.y = x, y
+
+        character = self.characters[pid]
+        if server_time is None:
+            character.x, character.y = x, y
+        else:
+            self.remote.add(character.row, server_time, x, y)
+
+    def apply_moves(self, message: str, received: Optional[float] = None):
+        """
+        Update characters from a MoveTo message, which can hold several moves split by |
+
+        The first part can be "@" and the server time the moves were made at.
+        """
+        moves = message.removeprefix("MoveTo: ").split("|")
+        server_time = None
+        if moves[0].startswith("@"):
+            server_time = float(moves.pop(0)[1:])
+            self.remote.observe(server_time, received)
+        for move in moves:
+            pid, x, y = move.split(",")
+            self.update_character(pid, int(x), int(y), server_time)
+
+    def apply_ack(self, message: str):
+        """
+        Reconcile our character with where the server says a move we sent left it
+
+        If it was put somewhere else, the movement we've made since is kept, from there.
+        """
+        seq, x, y = (int(value) for value in message.removeprefix("Ack: ").split(","))
+        predicted = None
+        with self.move_lock:
+            while self.unacked and self.unacked[0][0] <= seq:
+                sent_seq, sent_x, sent_y = self.unacked.popleft()
+                if sent_seq == seq:
+                    predicted = (sent_x, sent_y)
+            if predicted is None or predicted == (x, y) or self.character is None:
+                return
+
+            dx, dy = x - predicted[0], y - predicted[1]
+            self.unacked = deque(((s, px + dx, py + dy) for s, px, py in self.unacked), maxlen=self.unacked.maxlen)
+            if self.latest_move is not None:
+                move_x, move_y, now = self.latest_move
+                self.latest_move = (move_x + dx, move_y + dy, now)
+        self.character.x += dx
+        self.character.y += dy
+
+    def apply_correction(self, message: str):
+        """Put our character back where the server says it is, after it rejected a move."""
+        x, y = message.removeprefix("Correct: ").split(",")
+        if self.character is not None:
+            self.character.x, self.character.y = int(x), int(y)
+
+    async def recv_reply(self, websocket) -> str:
+        """
+        Receive the next message that isn't a move
+
+        Moves broadcast by the server can arrive at any time, even between the two halves of
+        another broadcast, so they're passed on to the game on the way.
+        """
+        while True:
+            message = await websocket.recv()
+            if message.startswith("MoveTo:"):
+                self.post(self.apply_moves, message, time.perf_counter())
+            elif message.startswith("Ack:"):
+                self.post(self.apply_ack, message)
+            elif message.startswith("Correct:"):
+                self.post(self.apply_correction, message)
+            elif message.startswith("Turn:"):
+                self.post(self.apply_turn, message)
+            else:
+                return message
+
+    def run_in_background(self, coroutine):
+        """Run a coroutine as a task on the network thread, kept until it's done, printing anything it raises."""
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.task_done)
+
+    def task_done(self, task: asyncio.Task):
+        """Forget a finished background task, after printing its error if it failed."""
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            traceback.print_exception(task.exception())
+
+    def post(self, func, *args):
+        """Call a function on the game's thread on its next frame, from the network thread."""
+        self.inbox.put((func, args))
+        if self.game is not None:
+            self.game.wake()
+
+    def send(self, *messages: str, prompts: int = 0):
+        """Queue messages to be sent together to the server, from any thread."""
+        if self.loop is None:
+            print("Not connected, dropping", messages)
+            return
+        self.loop.call_soon_threadsafe(self.outbox.put_nowait, (messages, prompts, None, None))
+
+    async def request(self, *messages: str, prompts: int = 0, prefix: str) -> str:
+        """
+        Send messages to the server from the network thread, and wait for the reply
+
+        The reply is the first message starting with prefix, which is taken off. Chat and
+        anything else arriving in the meantime goes to the chat panel as usual.
+        """
+        reply = asyncio.get_running_loop().create_future()
+        self.outbox.put_nowait((messages, prompts, reply, prefix))
+        return await reply
+
+    def send_command(self, text: str):
+        """Send a menu option, command or chat message to the server."""
+        if text == "Exit Game":
+            self.send(f"PID###{self.pid}: {self.name}: {text}")
+            self.send(options_dict[5], prompts=command_prompts[options_dict[5]])
+            self.loop.call_soon_threadsafe(self.outbox.put_nowait, None)  # Then disconnect
+        elif text in options_dict.values() or text in special_commands or text.startswith("/"):
+            prompts = command_prompts["/nick"] if text.startswith("/nick") else command_prompts.get(text, 0)
+            self.send(text, prompts=prompts)
+        else:
+            self.send(f"PID###{self.pid}: {self.name}: {text}")
 
     def frame_ui(self, screen: pygame.Surface) -> list[pygame.Rect]:
         """Renders the ui that's updated each frame."""
-        for rect, text in zip(self.server_rects, self.server_rects):
-            # pygame.draw.rect(self.screen, white, rect)
-            pygame.draw.rect(screen, black, rect, width=1)
-            self.updated_rects.append(rect)
-            # text = self.font.render(str(text), True, black)
-            # self.screen.blit(text, (rect.x + 2, rect.y))
+        for row, (rect, text) in enumerate(zip(self.chat_bars, reversed(self.texts))):
+            text = str(text)
+            if self.chat_rows[row] == text:
+                continue
+            self.chat_rows[row] = text
 
-        for rect, text in zip(self.chat_bars, reversed(self.texts)):
             pygame.draw.rect(screen, white, rect)
             pygame.draw.rect(screen, black, rect, width=1)
-            text = self.font.render(str(text), True, black)
-            text_updated = screen.blit(text, (rect.x + 2, rect.y))
+            text_updated = screen.blit(self.text_cache.render(text), (rect.x + 2, rect.y))
             self.updated_rects.append(rect)
             self.updated_rects.append(text_updated)
 
         new_rects = self.updated_rects
-        self.updated_rects = [self.screen.get_rect()]
+        self.updated_rects = []
         return new_rects
 
+    @property
+    def active(self) -> bool:
+        """Keep frames coming while a sound waits to load, so it isn't held back by idle throttling."""
+        return self.sounds.pending
+
     def update(self, screen: pygame.Surface, dt: float) -> list[pygame.Rect]:
         """Called each frame by the Game."""
-        for sound in self.to_play:
-            self.sounds[sound].play()
-        self.to_play = []
+        while True:
+            try:
+                func, args = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            func(*args)
+        self.sounds.update()
 
         self.counter += dt * 2
 
@@ -316,20 +654,20 @@ class Player:
 
     def on_event(self, event):
         """Handle incoming window events."""
-        print("EVT", event)
         if event.type == pygame.MOUSEBUTTONDOWN:
             for rect, text in self.menu_rects:
                 if rect.collidepoint(event.pos):
-                    self.comm_text = text
+                    self.send_command(text)
 
             if self.text_edi_rect.collidepoint(event.pos):
                 self.shift_active = True
                 pygame.draw.rect(self.screen, grey, rect=self.text_edi_rect)
+                self.updated_rects.append(self.text_edi_rect)
 
         if self.shift_active:
             if event.type == pygame.KEYUP:
                 if event.key in [pygame.K_LSHIFT, pygame.K_RSHIFT]:
-                    self.text_buffer.append(pygame.key.name(event.key) + "end")
+                    self.input_buffer.shift = False
 
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_RETURN:
@@ -337,156 +675,239 @@ class Player:
                     self.comm_text = self.print_buffer()
                     if self.comm_text.startswith("/"):
                         self.handle_command()
-                    self.text_buffer.clear()
+                    self.send_command(self.comm_text)
+                    self.comm_text = None
+                    self.input_buffer.clear()
 
                 elif event.key in [pygame.K_LSHIFT, pygame.K_RSHIFT]:
-                    self.text_buffer.append(pygame.key.name(event.key) + "start")
+                    self.input_buffer.shift = True
                 elif event.key == pygame.K_BACKSPACE:
-                    self.text_buffer.append('back')
+                    self.input_buffer.backspace()
                 elif event.key == pygame.K_SPACE:
-                    self.text_buffer.append(" ")
+                    self.input_buffer.insert(" ")
                 else:
-                    self.text_buffer.append(pygame.key.name(event.key))
+                    self.input_buffer.insert(pygame.key.name(event.key))
 
             if self.shift_active:
                 pygame.draw.rect(self.screen, grey, rect=self.text_edi_rect)
             else:
                 pygame.draw.rect(self.screen, white, rect=self.text_edi_rect)
             pygame.draw.rect(self.screen, (66, 155, 245), self.text_edi_rect, width=1)
-            text = self.font.render(self.print_buffer()[-40:] + ("|" if int(self.counter) % 2 else ""), True, black)
+            text = self.font.render(self.input_buffer.tail(40) + ("|" if int(self.counter) % 2 else ""), True, black)
             self.screen.blit(text, (self.text_edi_rect.x + 5, self.text_edi_rect.y + 2))
-            self.updated_rects.append(self.screen.get_rect())
-
-        key_sound_map = dict(zip(
-            [
-                pygame.K_1,
-                pygame.K_2,
-                pygame.K_3,
-                pygame.K_4,
-                pygame.K_5,
-                pygame.K_6,
-                pygame.K_7,
-                pygame.K_8,
-            ],
-            self.sounds.keys(),
-        ))
+            self.updated_rects.append(self.text_edi_rect)
 
         if self.in_game:
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_r:
                     new_seed = MapGen.generate_seed()
                     new_seed = int(new_seed*random.random())
-                    self.game_data_pending.append(("Change Seed", new_seed))
-                elif event.key in key_sound_map:
-                    self.game_data_pending.append(("Play Sound", key_sound_map[event.key]))
+                    self.send("Change Seed", str(new_seed), prompts=command_prompts["Change Seed"])
+                elif event.key in self.key_sound_map:
+                    self.send("Play Sound", self.key_sound_map[event.key], prompts=command_prompts["Play Sound"])
 
     async def estab_comms(self):
-        """Establish asynchronous communication with server, handle game loop"""
+        """Establish asynchronous communication with server, then read and write until it closes"""
         print("Connecting to...", self.websocket_url)
         async with websockets.connect(uri=self.websocket_url) as websocket:
-            while self.running:
+            await websocket.send('Get ID')      # first message to server like a pseudo-handshake
+            received_message = await websocket.recv()
+            print(received_message)
+            self.loop = asyncio.get_running_loop()
+            self.outbox = asyncio.Queue()
+            self.sending = asyncio.Lock()
+            self.move_ready = asyncio.Event()
+            self.pid = int(received_message.split("###")[-1])
+            if self.use_datagrams:
+                await self.open_datagrams(websocket)
+
+            writers = [
+                asyncio.create_task(self.write_messages(websocket)),
+                asyncio.create_task(self.send_moves(websocket)),
+            ]
+            for writer in writers:
+                writer.add_done_callback(self.task_done)  # So a writer failing doesn't go unnoticed
+            try:
+                await self.read_messages(websocket)
+            except websockets.ConnectionClosed:
+                pass  # We left, or the server went away
+            except Exception as _e:  # noqa: F841
+                traceback.print_exc()
+            finally:
+                for writer in writers:
+                    writer.cancel()
+                if self.datagrams is not None:
+                    self.datagrams.close()
+                self.running = False
+                if self.game is not None:
+                    self.game.running = False
+                self.post(self.texts.append, 'Bye, Game closed')
+
+    async def write_messages(self, websocket):
+        """Send messages as soon as they're queued, holding the next back while the server prompts us."""
+        while True:
+            item = await self.outbox.get()
+            if item is None:
+                await websocket.close()
+                return
+
+            messages, prompts, reply, prefix = item
+            async with self.sending:
+                self.answered = asyncio.Semaphore(0)
+                self.reply, self.reply_prefix = reply, prefix
+                for message in messages:
+                    await websocket.send(message)
                 try:
-                    if self.pid is None:
-                        await websocket.send('Get ID')      # first message to server like a pseudo-handshake
-                        received_message = await websocket.recv()
-                        print(received_message)
-                        pid = int(received_message.split("###")[-1])
-                        self.pid = pid
+                    for _ in range(prompts):
+                        await asyncio.wait_for(self.answered.acquire(), PROMPT_TIMEOUT)
+                    if reply is not None:
+                        await asyncio.wait_for(reply, PROMPT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    print("No answer from the server to", messages[0])
+                self.reply = self.reply_prefix = None
+
+    async def open_datagrams(self, websocket):
+        """Ask the server for a datagram channel for movement, and start opening it if there is one."""
+        await websocket.send("Datagram Channel")
+        reply = await self.recv_reply(websocket)
+        if not reply.startswith("Datagram: ") or reply == "Datagram: none":
+            print("No datagram channel, movement goes over the websocket")
+            return
+
+        port, self.datagram_token = reply.removeprefix("Datagram: ").split(",")
+        try:
+            _transport, self.datagrams = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: DatagramChannel(self.datagram_received),
+                remote_addr=(urlparse(self.websocket_url).hostname, int(port)),
+            )
+        except OSError as e_mess:
+            print("Couldn't open a datagram channel, movement goes over the websocket:", e_mess)
+            return
+        self.run_in_background(self.greet_datagrams())
+
+    async def greet_datagrams(self):
+        """Say hello over the datagram channel until the server answers, which shows datagrams get through."""
+        for _ in range(DATAGRAM_HELLOS):
+            if self.datagram_ready:
+                print("Sending movement by datagram")
+                return
+            self.datagrams.send(f"Hello {self.datagram_token}")
+            await asyncio.sleep(0.5)
+        if not self.datagram_ready:
+            print("No answer over the datagram channel, movement goes over the websocket")
+
+    def datagram_received(self, message: str, address: tuple):
+        """Handle a datagram from the server, on the network thread."""
+        if message == "Welcome":
+            self.datagram_ready = True
+        elif message.startswith("MoveTo:"):
+            self.post(self.apply_moves, message, time.perf_counter())
+        elif message.startswith("Ack:"):
+            self.post(self.apply_ack, message)
+
+    def take_move(self) -> tuple[int, int, int]:
+        """Take the latest position to send, numbering it, as seq, x and y."""
+        with self.move_lock:
+            move, self.latest_move = self.latest_move, None
+            x, y, _ = move
+            self.move_seq += 1
+            self.unacked.append((self.move_seq, x, y))
+            return self.move_seq, x, y
+
+    async def send_moves(self, websocket):
+        """Send our latest position at most move_rate times a second, or straight away once we stop."""
+        loop = asyncio.get_running_loop()
+        last_sent = -math.inf
+        resends = 0
+        while True:
+            if self.datagram_ready and self.unacked and resends < MAX_RESENDS:
+                try:
+                    await asyncio.wait_for(self.move_ready.wait(), RESEND_AFTER)
+                    resends = 0
+                except asyncio.TimeoutError:
+                    # The datagram or its Ack may be lost, and once we've stopped, no later move makes up for it
+                    with self.move_lock:
+                        if self.unacked and self.latest_move is None:
+                            _seq, x, y = self.unacked[-1]
+                            self.latest_move = (x, y, True)
+                    resends += 1
+            else:
+                await self.move_ready.wait()
+                resends = 0
+            self.move_ready.clear()
+            if self.latest_move is None:
+                continue
 
+            delay = last_sent + 1 / self.move_rate - loop.time()
+            if delay > 0 and not self.latest_move[2]:
+                try:
+                    # Cut short if we stop moving in the meantime
+                    await asyncio.wait_for(self.move_ready.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self.move_ready.clear()
+
+            if self.datagram_ready:
+                seq, x, y = self.take_move()
+                self.datagrams.send(f"Move {self.datagram_token},{seq},{x},{y}")
+            else:
+                async with self.sending:
+                    seq, x, y = self.take_move()
+                    await websocket.send("MoveTo")
+                    await websocket.send(f"{self.pid},{x},{y},{seq}")
+            last_sent = loop.time()
+
+    async def answer(self, websocket, value):
+        """Answer one of the server's prompts, letting the writer carry on once they're all answered."""
+        await websocket.send(str(value))
+        self.answered.release()
+
+    async def read_messages(self, websocket):
+        """Handle messages from the server as they arrive, passing anything for the game to its thread."""
+        while self.running:
+            received_message = await websocket.recv()
+
+            match received_message:
+                case 'Enter Player ID':
+                    print("Replying with player ID:", self.pid)
+                    await self.answer(websocket, self.pid)
+                case 'Enter Room ID':
+                    print("Replying with room ID:", str(self.rid))
+                    await self.answer(websocket, self.rid)
+                case 'Enter World Seed':
+                    print("Replying with world seed:", self.seed)
+                    await self.answer(websocket, self.seed)
+                case 'Start Game':
+                    seed = await self.recv_reply(websocket)
+                    self.game_started = True
+                    self.post(self.start_game_client, seed)
+                    self.run_in_background(self.create_players())
+                case 'Tell Nick':
+                    await websocket.send(self.name)
+                case 'Change Seed':
+                    seed = await self.recv_reply(websocket)
+                    print("Changing map seed to,", seed)
+                    self.post(self.change_seed, seed)
+                case 'Play Sound':
+                    sound = await self.recv_reply(websocket)
+                    print("Playing sound", sound)
+                    self.post(self.sounds.play, sound)
+                case _ if received_message.startswith("Turn:"):
+                    self.post(self.apply_turn, received_message)
+                case _ if received_message.startswith("Lockstep:"):
+                    self.post(self.start_lockstep, received_message)
+                case _ if received_message.startswith("Ack:"):
+                    self.post(self.apply_ack, received_message)
+                case _ if received_message.startswith("Correct:"):
+                    self.post(self.apply_correction, received_message)
+                case _ if received_message.startswith("MoveTo:"):
+                    if not self.game_started:
+                        self.game_started = True
+                        self.run_in_background(self.join_game_in_progress())
+                    self.post(self.apply_moves, received_message, time.perf_counter())
+                case _:
+                    waiting = self.reply is not None and not self.reply.done()
+                    if waiting and received_message.startswith(self.reply_prefix):
+                        self.reply.set_result(received_message.removeprefix(self.reply_prefix))
                     else:
-                        special_commands = ["Join Room", "List Players", "Start Game"]
-
-                        if self.game_data_pending:
-                            while self.game_data_pending:
-                                key, *rest = self.game_data_pending.pop(0)
-                                if key == "MoveTo":
-                                    pid, x, y = rest
-                                    await websocket.send("MoveTo")
-                                    await websocket.send(f"{pid},{x},{y}")
-                                elif key == "Change Seed":
-                                    await websocket.send("Change Seed")
-                                    await websocket.send(str(rest[0]))
-                                elif key == "Play Sound":
-                                    await websocket.send("Play Sound")
-                                    await websocket.send(str(rest[0]))
-
-                        if self.comm_text is None:
-                            pass
-                        elif self.comm_text in options_dict.values() \
-                                or self.comm_text in special_commands \
-                                or self.comm_text.startswith("/"):
-                            if self.comm_text == "Exit Game":
-                                self.running = False
-                                self.game.running = False
-                                await websocket.send(f"PID###{self.pid}: {self.name}: {self.comm_text}")
-                                raise KeyboardInterrupt()
-                            await websocket.send(f"{self.comm_text}")
-                        else:
-                            await websocket.send(f"PID###{self.pid}: {self.name}: {self.comm_text}")
-
-                        self.comm_text = None
-                        while self.running:
-                            # Handle when server wants a response from us
-                            try:
-                                received_message = await asyncio.wait_for(websocket.recv(), 0.5)
-                            except asyncio.TimeoutError:
-                                break
-
-                            match received_message:
-                                case 'Enter Player ID':
-                                    print("Replying with player ID:", self.pid)
-                                    await websocket.send(str(self.pid))
-                                case 'Enter Room ID':
-                                    print("Replying with room ID:", str(self.rid))
-                                    await websocket.send(str(self.rid))
-                                case 'Enter World Seed':
-                                    print("Replying with world seed:", self.seed)
-                                    await websocket.send(str(self.seed))
-                                case 'Start Game':
-                                    seed = await websocket.recv()
-                                    self.start_game_client(seed)
-                                    await self.create_players(websocket)
-                                case 'Tell Nick':
-                                    await websocket.send(self.name)
-                                case 'Change Seed':
-                                    seed = await websocket.recv()
-                                    print("Changing map seed to,", seed)
-                                    self.change_seed(seed)
-                                case 'Play Sound':
-                                    sound = await websocket.recv()
-                                    print("Playing sound", sound)
-                                    self.to_play.append(sound)
-                                case _:
-                                    if not received_message.startswith("MoveTo:"):
-                                        self.texts += received_message.split("\n")
-                                        break
-                                    else:
-                                        message = received_message.removeprefix("MoveTo: ")
-                                        if not self.character:
-                                            await websocket.send('Room Seed')
-                                            _ = await websocket.recv()
-                                            print(_)
-                                            await websocket.send(str(self.rid))
-                                            seed = await websocket.recv()
-                                            print("Got in progress room seed:", seed)
-                                            self.start_game_client(seed)
-                                        pid, x, y = message.split(",")
-                                        self.update_character(pid, int(x), int(y))
-
-                except Exception as _e:  # noqa: F841
-                    # handle abrupt termination as well 'Leave game' option
-                    traceback.print_exc()
-                    self.running = False
-                    self.game.running = False
-                    await websocket.send(options_dict[5])
-                    received_message = await websocket.recv()
-                    self.texts.append(received_message)
-
-                    await websocket.send(str(self.pid))
-                    # print('Player ID sent')
-                    received_message = await websocket.recv()
-                    # self.texts.append(received_message)
-
-                    self.texts.append('Bye, Game closed')
-                    pygame.quit()
-                    break
+                        self.post(self.texts.extend, received_message.split("\n"))
@@ -0,0 +1,71 @@
+from collections import OrderedDict
+
+import pygame
+
+
+class TextCache:
+    """Least-recently-used cache of rendered text surfaces for a font."""
+
+    def __init__(self, font: pygame.font.Font, maxsize: int = 256):
+        self.font = font
+        self.maxsize = maxsize
+        self._surfaces = OrderedDict()
+
+    def render(self, text: str, color: tuple = (0, 0, 0), antialias: bool = True) -> pygame.Surface:
+        """Render text, reusing the surface from an earlier identical render."""
+        key = (text, color, antialias)
+        surface = self._surfaces.get(key)
+        if surface is None:
+            surface = self._surfaces[key] = self.font.render(text, antialias, color)
+            if len(self._surfaces) > self.maxsize:
+                self._surfaces.popitem(last=False)
+        else:
+            self._surfaces.move_to_end(key)
+        return surface
+
+
+class InputBuffer:
+    """
+    Editable chat input, updated in constant time per keystroke
+
+    A line break is inserted every `wrap` characters typed, and text typed
+    while shift is held is uppercased.
+    """
+
+    def __init__(self, wrap: int = 20):
+        self.wrap = wrap
+        self.clear()
+
+    def clear(self) -> None:
+        """Empty the buffer."""
+        self._chunks = []
+        self._counter = 0
+        self.shift = False
+
+    def insert(self, text: str) -> None:
+        """Type some text, such as a key name."""
+        self._counter += len(text)
+        if self._counter > self.wrap:
+            self._chunks.append("\n")
+            self._counter = 0
+
+        self._chunks.append(text.upper() if self.shift else text)
+
+    def backspace(self) -> None:
+        """Remove the last thing typed."""
+        if self._chunks:
+            self._chunks.pop()
+
+    def tail(self, length: int) -> str:
+        """The last characters of the buffer, without joining the whole of it."""
+        tail = []
+        size = 0
+        for chunk in reversed(self._chunks):
+            if size >= length:
+                break
+            tail.append(chunk)
+            size += len(chunk)
+        return "".join(reversed(tail))[-length:]
+
+    def __str__(self) -> str:
+        return "".join(self._chunks)